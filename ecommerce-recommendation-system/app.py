@@ -1,46 +1,184 @@
+import functools
+import hmac
+import logging
 import os
-from flask import Flask, render_template, request, jsonify
+import time
+from flask import Flask, Response, abort, g, render_template, request, jsonify
 from models.data_processor import DataProcessor
 from models.recommendation_engine import RecommendationEngine
+from models.catalog import ProductCatalog
+from models.recommendation_store import RecommendationStore
+from models.artifacts import artifacts_fresh, build_lock, read_manifest
+from models.aggregates import DashboardAggregates
+from models.recommendation_cache import RecommendationCache
+from models.model_manager import ModelManager, ModelSnapshot
+from models.product_filters import ProductFilters
+from models import metrics
 from config import Config
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Global variables
-dp = None
-re = None
-
-
-def initialize_system():
-    """Initialize the recommendation system"""
-    global dp, re
-
-    try:
-        # Check if sample data exists, if not create it
-        if not os.path.exists(app.config["DATA_FILE"]):
-            print("Generating sample data...")
-            from data.create_sample_data import generate_sample_data
+logging.basicConfig(
+    level=Config.LOG_LEVEL,
+    format="%(asctime)s %(levelname)s %(name)s %(message)s",
+)
+logger = logging.getLogger(__name__)
 
-            df = generate_sample_data()
-            df.to_csv(app.config["DATA_FILE"], index=False)
-            print("Sample data generated successfully!")
-
-        # Initialize data processor and recommendation engine
+# Global variables
+manager = None
+store = None
+
+# Product fields returned alongside recommendations
+PRODUCT_FIELDS = ["product_id", "product_name", "category", "price", "brand", "rating"]
+
+
+def engine_settings():
+    """Constructor arguments of the engine, from the app config"""
+    return {
+        "content_index": app.config["CONTENT_INDEX"],
+        "n_probe": app.config["CONTENT_N_PROBE"],
+        "hybrid_weights": app.config["HYBRID_WEIGHTS"],
+        "n_jobs": app.config["BUILD_WORKERS"],
+    }
+
+
+def artifacts_current(artifact_path):
+    """Whether saved artifacts match both the data file and the settings"""
+    return artifacts_fresh(artifact_path, app.config["DATA_FILE"], engine_settings())
+
+
+def train_engine(dp):
+    """Load the data and build a new engine from it"""
+    dp.load_data(columns=DataProcessor.MODEL_COLUMNS)
+    engine = RecommendationEngine(dp, **engine_settings())
+    engine.build_models()
+    return engine
+
+
+def build_snapshot(shared=False, build=True):
+    """Build or load the models into a new snapshot
+
+    With ``shared``, the models are always served from memory-mapped
+    artifacts and the dashboard figures are computed up front, so that
+    processes forked afterwards (see wsgi.py) share one copy of everything.
+    Processes sharing the artifacts take turns through ``build_lock``: the
+    first to find them stale rebuilds them, the others then load them. A
+    shared snapshot is not reloaded (None is returned) when the current one
+    already comes from the same artifacts; without ``build``, stale
+    artifacts are loaded as they are instead of rebuilt.
+    """
+    # Initialize data processor and recommendation engine, reusing saved
+    # artifacts when they were built from the current data file
+    dp = DataProcessor(app.config["DATA_FILE"])
+    artifact_path = app.config["ARTIFACT_PATH"]
+    source = None
+    if shared:
+        with build_lock(artifact_path):
+            if build and not artifacts_current(artifact_path):
+                train_engine(dp).save_model(artifact_path)
+            manifest = read_manifest(artifact_path)
+            if manifest is None:
+                raise ValueError(f"No model artifacts in {artifact_path}")
+            source = manifest["created"]
+            current = manager.current if manager is not None else None
+            if current is not None and current.source == source:
+                return None
+            # Serve the file-backed arrays, whose pages the workers share
+            # through the page cache
+            engine = RecommendationEngine.load_model(
+                artifact_path, dp, hybrid_weights=app.config["HYBRID_WEIGHTS"]
+            )
+        logger.info("Loaded model artifacts from %s", artifact_path)
+    elif app.config["WARM_START"] and artifacts_current(artifact_path):
+        engine = RecommendationEngine.load_model(
+            artifact_path, dp, hybrid_weights=app.config["HYBRID_WEIGHTS"]
+        )
+        logger.info("Loaded model artifacts from %s", artifact_path)
+    else:
+        engine = train_engine(dp)
+        if app.config["WARM_START"]:
+            engine.save_model(artifact_path)
+
+    # Cache results in process, starting with the most active users
+    engine.cache = RecommendationCache(
+        app.config["REC_CACHE_BYTES"], app.config["REC_CACHE_TTL"]
+    )
+    if app.config["REC_CACHE_PREWARM"] > 0:
+        hot_users = dp.user_history.most_active_users(app.config["REC_CACHE_PREWARM"])
+        engine.prewarm_cache(dp.user_map.inverse(hot_users).tolist())
+
+    aggregates = DashboardAggregates(dp)
+    if shared:
+        aggregates.get()
+    return ModelSnapshot(dp, engine, aggregates, source)
+
+
+def initialize_system(shared=False):
+    """Initialize the recommendation system
+
+    The first snapshot is built before returning. Later ones are built in
+    the background (every ``MODEL_REFRESH_INTERVAL`` seconds or through
+    ``/admin/rebuild``) and swapped in when complete. With ``shared``, one
+    process rebuilds the artifacts and every ``MODEL_RELOAD_INTERVAL``
+    seconds the others load what it saved.
+    """
+    global manager, store
+
+    # Check if sample data exists, if not create it
+    if not os.path.exists(app.config["DATA_FILE"]):
+        logger.info("Generating sample data")
+        from data.create_sample_data import generate_sample_data
+
+        df = generate_sample_data()
+        df.to_csv(app.config["DATA_FILE"], index=False)
+
+    # Serve precomputed recommendations when available
+    if app.config["SERVE_FROM_STORE"]:
+        if RecommendationStore.exists(app.config["REC_STORE_PATH"]):
+            store = RecommendationStore.open(app.config["REC_STORE_PATH"])
+            logger.info("Serving recommendations from %s", app.config["REC_STORE_PATH"])
+        else:
+            logger.info("No recommendation store found, computing live")
+
+    manager = ModelManager(
+        functools.partial(build_snapshot, shared),
+        interval=app.config["MODEL_REFRESH_INTERVAL"],
+        reloader=functools.partial(build_snapshot, True, False) if shared else None,
+        reload_interval=app.config["MODEL_RELOAD_INTERVAL"],
+    )
+    if manager.rebuild(wait=True):
+        logger.info("Recommendation system initialized")
+    else:
+        # Create a fallback system
         dp = DataProcessor(app.config["DATA_FILE"])
         dp.load_data()
+        dp.catalog = ProductCatalog.from_dataframe(dp.df)
+        manager.publish(
+            ModelSnapshot(dp, RecommendationEngine(dp), DashboardAggregates(dp))
+        )
 
-        re = RecommendationEngine(dp)
-        re.build_models()
+    # Threads do not survive a fork; pre-fork workers start their own
+    # schedule (see gunicorn.conf.py)
+    if not shared:
+        manager.start()
 
-        print("Recommendation system initialized successfully!")
 
-    except Exception as e:
-        print(f"Error initializing system: {e}")
-        # Create a fallback system
-        dp = DataProcessor(app.config["DATA_FILE"])
-        dp.load_data()
-        re = RecommendationEngine(dp)
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_latency(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        # Label by route pattern so ids in the URL don't explode the series
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - start, route=route, status=response.status_code
+        )
+    return response
 
 
 @app.route("/")
@@ -51,152 +189,111 @@ def index():
 @app.route("/dashboard")
 def dashboard():
     """Main dashboard with analytics"""
+    # Use one snapshot for the whole request, even if a rebuild swaps it
+    snapshot = manager.current
     try:
-        # Basic statistics
-        total_users = dp.df["user_id"].nunique()
-        total_products = dp.df["product_id"].nunique()
-        total_transactions = len(dp.df)
-        avg_rating = dp.df["rating"].mean()
-
-        # Top products - ensure we have the right columns
-        top_products_data = (
-            dp.df.groupby("product_id")
-            .agg(
-                {
-                    "product_name": "first",
-                    "category": "first",
-                    "rating": "mean",
-                    "purchase_count": "sum",
-                    "price": "first",
-                }
-            )
-            .nlargest(5, "purchase_count")
-            .reset_index()
-        )
-
-        # Convert to dictionary with proper handling
-        top_products_dict = []
-        for _, row in top_products_data.iterrows():
-            top_products_dict.append(
-                {
-                    "product_id": int(row["product_id"]),
-                    "product_name": str(row["product_name"]),
-                    "category": str(row["category"]),
-                    "rating": float(row["rating"]),
-                    "purchase_count": int(row["purchase_count"]),
-                    "price": float(row["price"]),
-                    "brand": str(row["brand"]) if "brand" in row else "Generic",
-                }
-            )
-
-        # Category distribution - ensure proper data format
-        category_dist_data = dp.df.groupby("category").size().reset_index(name="count")
-        category_dist_dict = []
-        for _, row in category_dist_data.iterrows():
-            category_dist_dict.append(
-                {"category": str(row["category"]), "count": int(row["count"])}
-            )
-
-        # Get market insights
-        insights = {
-            "avg_price": float(dp.df["price"].mean()),
-            "top_category": str(category_dist_data.iloc[0]["category"]),
-            "avg_products_per_user": float(
-                dp.df.groupby("user_id")["product_id"].nunique().mean()
-            ),
-        }
+        # Figures are computed once per data version and reused
+        aggregates = snapshot.aggregates.get()
+        stats = aggregates["stats"]
 
         return render_template(
             "dashboard.html",
-            total_users=total_users,
-            total_products=total_products,
-            total_transactions=total_transactions,
-            avg_rating=round(avg_rating, 2),
-            top_products=top_products_dict,
-            category_dist=category_dist_dict,
-            insights=insights,
+            total_users=stats["total_users"],
+            total_products=stats["total_products"],
+            total_transactions=stats["total_transactions"],
+            avg_rating=stats["average_rating"],
+            top_products=aggregates["top_products"],
+            category_dist=aggregates["category_dist"],
+            insights=aggregates["insights"],
         )
 
     except Exception as e:
-        print(f"Dashboard error: {e}")
-        import traceback
-
-        traceback.print_exc()
+        logger.exception("Dashboard error")
         return f"Error loading dashboard: {str(e)}"
 
 
 @app.route("/recommendations", methods=["GET", "POST"])
 def recommendations():
     """Get personalized recommendations"""
+    snapshot = manager.current
     if request.method == "POST":
         user_id = int(request.form["user_id"])
         method = request.form.get("method", "hybrid")
         n_recommendations = int(request.form.get("n_recommendations", 10))
 
         # Get recommendations
-        recommended_product_ids = re.get_user_recommendations(
+        recommended_product_ids = snapshot.engine.get_user_recommendations(
             user_id, method, n_recommendations
         )
 
         # Get product details
-        recommended_products = []
-        for product_id in recommended_product_ids:
-            product_info = dp.df[dp.df["product_id"] == product_id].iloc[0]
-            recommended_products.append(
-                {
-                    "product_id": product_id,
-                    "product_name": product_info["product_name"],
-                    "category": product_info["category"],
-                    "price": product_info["price"],
-                    "brand": product_info["brand"],
-                    "rating": product_info["rating"],
-                }
-            )
+        recommended_products = snapshot.dp.catalog.get_many(recommended_product_ids)
 
         # Get user history
-        user_history = dp.df[dp.df["user_id"] == user_id].nlargest(5, "timestamp")
+        items, ratings = snapshot.dp.user_history.last_interactions(user_id, 5)
+        user_history = snapshot.dp.catalog.get_many(
+            snapshot.dp.product_map.inverse(items),
+            ["product_id", "product_name", "category"],
+        )
+        for item, rating in zip(user_history, ratings.tolist()):
+            item["rating"] = rating
 
         return render_template(
             "recommendations.html",
             user_id=user_id,
             method=method,
             recommendations=recommended_products,
-            user_history=user_history.to_dict("records"),
+            user_history=user_history,
         )
 
     return render_template("recommendations.html")
 
 
+def request_filters(args):
+    """Product filters from query arguments; category and brand may repeat"""
+    filters = {
+        field: args.get(field)
+        for field in ProductFilters.FIELDS
+        if args.get(field) not in (None, "")
+    }
+    for field in ("category", "brand"):
+        if field in filters:
+            filters[field] = args.getlist(field)
+    return filters
+
+
 @app.route("/api/recommend/<int:user_id>")
 def api_recommend(user_id):
-    """API endpoint for recommendations"""
+    """API endpoint for recommendations
+
+    Accepts the ``ProductFilters`` fields as query arguments, e.g.
+    ``?category=Books&max_price=500&in_stock=1``.
+    """
+    snapshot = manager.current
     method = request.args.get("method", "hybrid")
     n_recommendations = int(request.args.get("n", 10))
 
     try:
-        recommended_product_ids = re.get_user_recommendations(
-            user_id, method, n_recommendations
-        )
-
-        recommended_products = []
-        for product_id in recommended_product_ids:
-            product_info = dp.df[dp.df["product_id"] == product_id].iloc[0]
-            recommended_products.append(
-                {
-                    "product_id": product_id,
-                    "product_name": product_info["product_name"],
-                    "category": product_info["category"],
-                    "price": product_info["price"],
-                    "brand": product_info["brand"],
-                    "rating": product_info["rating"],
-                }
+        filters = request_filters(request.args)
+        recommended_product_ids = None
+        # Precomputed lists are unfiltered
+        if store is not None and not filters:
+            recommended_product_ids = store.get(user_id, method, n_recommendations)
+        if recommended_product_ids is None:
+            recommended_product_ids = snapshot.engine.get_user_recommendations(
+                user_id, method, n_recommendations, filters
             )
 
+        recommended_products = snapshot.dp.catalog.get_many(
+            recommended_product_ids, PRODUCT_FIELDS
+        )
+
         return jsonify(
             {
                 "success": True,
                 "user_id": user_id,
                 "method": method,
+                "filters": filters,
                 "recommendations": recommended_products,
             }
         )
@@ -204,44 +301,113 @@ def api_recommend(user_id):
         return jsonify({"success": False, "error": str(e)})
 
 
+@app.route("/api/recommend/batch", methods=["POST"])
+def api_recommend_batch():
+    """API endpoint for recommending to many users in one call"""
+    snapshot = manager.current
+    payload = request.get_json(silent=True) or {}
+    method = payload.get("method", "hybrid")
+    n_recommendations = int(payload.get("n", 10))
+
+    try:
+        user_ids = [int(user_id) for user_id in payload.get("user_ids", [])]
+        recommended_product_ids = snapshot.engine.recommend_batch(
+            user_ids, method, n_recommendations, filters=payload.get("filters")
+        )
+
+        if payload.get("details"):
+            recommendations = {
+                str(user_id): snapshot.dp.catalog.get_many(product_ids, PRODUCT_FIELDS)
+                for user_id, product_ids in zip(user_ids, recommended_product_ids)
+            }
+        else:
+            recommendations = {
+                str(user_id): product_ids
+                for user_id, product_ids in zip(user_ids, recommended_product_ids)
+            }
+
+        return jsonify(
+            {
+                "success": True,
+                "method": method,
+                "recommendations": recommendations,
+            }
+        )
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)})
+
+
 @app.route("/api/stats")
 def api_stats():
     """API endpoint for statistics"""
-    total_users = dp.df["user_id"].nunique()
-    total_products = dp.df["product_id"].nunique()
-    total_transactions = len(dp.df)
-    avg_rating = dp.df["rating"].mean()
-
+    snapshot = manager.current
     return jsonify(
         {
-            "total_users": total_users,
-            "total_products": total_products,
-            "total_transactions": total_transactions,
-            "average_rating": round(avg_rating, 2),
+            **snapshot.aggregates.stats(),
+            "recommendation_cache": snapshot.engine.cache.stats(),
         }
     )
 
 
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of timings, counters and model sizes"""
+    snapshot = manager.current
+    for component, nbytes in snapshot.engine.model_sizes().items():
+        metrics.MODEL_BYTES.set(nbytes, component=component)
+    metrics.MODEL_ENTITIES.set(len(snapshot.engine.user_map), kind="users")
+    metrics.MODEL_ENTITIES.set(len(snapshot.engine.product_map), kind="products")
+    metrics.MODEL_VERSION.set(snapshot.engine.version)
+
+    cache_stats = snapshot.engine.cache.stats()
+    for event in ("hits", "misses", "evictions", "entries"):
+        metrics.CACHE_EVENTS.set(cache_stats[event], event=event)
+    metrics.CACHE_BYTES.set(cache_stats["bytes"])
+    metrics.PROCESS_RSS.set(metrics.process_rss_bytes())
+
+    return Response(
+        metrics.REGISTRY.render(), content_type=metrics.MetricsRegistry.CONTENT_TYPE
+    )
+
+
+def _authorized():
+    """Whether the request carries the admin token; no token disables admin"""
+    token = app.config["ADMIN_TOKEN"]
+    given = request.headers.get("X-Admin-Token")
+    return bool(token) and given is not None and hmac.compare_digest(given, token)
+
+
+@app.route("/admin/model")
+def admin_model():
+    """Current model snapshot and rebuild status"""
+    if not _authorized():
+        abort(403)
+    return jsonify(manager.status())
+
+
+@app.route("/admin/rebuild", methods=["POST"])
+def admin_rebuild():
+    """Start a background model rebuild"""
+    if not _authorized():
+        abort(403)
+    started = manager.rebuild()
+    return jsonify({"started": started, **manager.status()}), 202 if started else 409
+
+
 @app.route("/product/<int:product_id>")
 def product_detail(product_id):
     """Product detail page with similar products"""
-    product_info = dp.df[dp.df["product_id"] == product_id].iloc[0]
+    snapshot = manager.current
+    product_info = snapshot.dp.catalog.get(product_id)
+    if product_info is None:
+        abort(404)
 
     # Get similar products
-    similar_products_ids = re.content_based_filtering(product_id, 5)
-    similar_products = []
-
-    for sim_product_id in similar_products_ids:
-        sim_product_info = dp.df[dp.df["product_id"] == sim_product_id].iloc[0]
-        similar_products.append(
-            {
-                "product_id": sim_product_id,
-                "product_name": sim_product_info["product_name"],
-                "category": sim_product_info["category"],
-                "price": sim_product_info["price"],
-                "rating": sim_product_info["rating"],
-            }
-        )
+    similar_products_ids = snapshot.engine.content_based_filtering(product_id, 5)
+    similar_products = snapshot.dp.catalog.get_many(
+        similar_products_ids,
+        ["product_id", "product_name", "category", "price", "rating"],
+    )
 
     return render_template(
         "product_detail.html", product=product_info, similar_products=similar_products
@@ -0,0 +1,303 @@
+"""Benchmark the build and query paths at several data scales
+
+Generates a synthetic dataset per scale, times every build stage and each
+recommendation method, and writes the results as JSON so runs can be
+compared across commits. Each scale runs in its own process so peak
+memory is measured per scale.
+
+    python benchmark.py --scales 10000 100000 1000000 --output bench.json
+    python benchmark.py --scales 10000 100000 --compare bench.json
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+from data.create_sample_data import SampleDataGenerator
+from models import metrics
+from models.data_processor import DataProcessor
+from models.recommendation_cache import RecommendationCache
+from models.recommendation_engine import RecommendationEngine
+
+METHODS = ["collaborative", "item", "content", "hybrid", "als"]
+
+# Stage time growing faster than n ** SUPERLINEAR between scales is flagged
+SUPERLINEAR = 1.5
+
+
+class PeakRSS:
+    """Samples the resident set size on a thread and keeps the peak
+
+    Reads ``/proc/self/statm`` where available; elsewhere falls back to the
+    process-lifetime peak from ``getrusage``.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+
+@contextlib.contextmanager
+def stage(results, name):
+    """Record wall time and peak RSS of a block under ``results[name]``"""
+    start = time.perf_counter()
+    with PeakRSS() as rss:
+        yield
+    results[name] = {
+        "seconds": round(time.perf_counter() - start, 4),
+        "peak_rss_mb": round(rss.peak / 2**20, 1),
+    }
+    log(f"  {name}: {results[name]['seconds']:.3f}s, {results[name]['peak_rss_mb']} MB")
+
+
+def build_stages(results, before):
+    """Record the internal stages timed by the last ``build_models`` call
+
+    Stored as ``build.<stage>``. The model stages run concurrently, so
+    their times add up to more than ``build_models`` itself.
+    """
+    for (name,), seconds in sorted(metrics.BUILD_STAGE_SECONDS.sums().items()):
+        seconds -= before.get((name,), 0)
+        if seconds <= 0:
+            continue
+        results[f"build.{name}"] = {"seconds": round(seconds, 4)}
+        log(f"  build.{name}: {seconds:.3f}s")
+
+
+def percentiles(latencies):
+    latencies = np.asarray(latencies) * 1000
+    return {
+        "calls": len(latencies),
+        "mean_ms": round(float(latencies.mean()), 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "p99_ms": round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def log(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def run_scale(n_transactions, args):
+    """Benchmark one data scale; returns a JSON-serializable dict"""
+    stages = {}
+    log(f"{n_transactions:,} transactions")
+
+    with tempfile.TemporaryDirectory() as workdir:
+        data_path = os.path.join(workdir, "transactions.csv")
+        with stage(stages, "generate"):
+            generator = SampleDataGenerator(
+                max(10, n_transactions // 5),
+                max(50, n_transactions // 100),
+                seed=args.seed,
+            )
+            for i, chunk in enumerate(generator.chunks(n_transactions)):
+                chunk.to_csv(data_path, mode="a", header=i == 0, index=False)
+
+        dp = DataProcessor(data_path)
+        with stage(stages, "load_data"):
+            dp.load_data(columns=DataProcessor.MODEL_COLUMNS)
+
+        # build_models preprocesses and extracts product features itself
+        engine = RecommendationEngine(
+            dp,
+            content_index=args.content_index,
+            n_probe=args.n_probe,
+            n_jobs=args.build_workers,
+        )
+        before = metrics.BUILD_STAGE_SECONDS.sums()
+        with stage(stages, "build_models"):
+            engine.build_models()
+        build_stages(stages, before)
+
+    # Measure the models, not the result cache
+    engine.cache = RecommendationCache(max_bytes=0)
+    rng = np.random.default_rng(args.seed)
+    user_ids = dp.user_map.ids
+    sample = rng.choice(user_ids, min(args.queries, len(user_ids)), replace=False)
+
+    methods = {}
+    for method in args.methods:
+        latencies = []
+        for user_id in sample.tolist():
+            start = time.perf_counter()
+            engine.get_user_recommendations(user_id, method, args.n)
+            latencies.append(time.perf_counter() - start)
+        methods[method] = percentiles(latencies)
+
+        batch = rng.choice(user_ids, min(args.batch_size, len(user_ids)), replace=False)
+        start = time.perf_counter()
+        engine.recommend_batch(batch.tolist(), method, args.n)
+        elapsed = time.perf_counter() - start
+        methods[method]["batch_users_per_s"] = round(len(batch) / elapsed, 1)
+        log(
+            f"  {method}: p50 {methods[method]['p50_ms']}ms, "
+            f"p99 {methods[method]['p99_ms']}ms, "
+            f"batch {methods[method]['batch_users_per_s']:,} users/s"
+        )
+
+    return {
+        "transactions": n_transactions,
+        "users": len(dp.user_map),
+        "products": len(dp.product_map),
+        "interactions": int(dp.user_item_matrix.nnz),
+        "stages": stages,
+        "methods": methods,
+    }
+
+
+def _run_scale_quietly(n_transactions, args):
+    # The pipeline prints progress to stdout; keep it out of the way
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return run_scale(n_transactions, args)
+
+
+def scaling(results):
+    """Growth exponent of each stage's time between consecutive scales
+
+    1 is linear, 2 quadratic. Exponents above ``SUPERLINEAR`` are flagged.
+    """
+    report = []
+    for small, large in zip(results, results[1:]):
+        size_ratio = np.log(large["transactions"] / small["transactions"])
+        for name, timing in large["stages"].items():
+            before = small["stages"][name]["seconds"]
+            if before <= 0.01 or timing["seconds"] <= 0:
+                continue
+            exponent = np.log(timing["seconds"] / before) / size_ratio
+            report.append(
+                {
+                    "stage": name,
+                    "from": small["transactions"],
+                    "to": large["transactions"],
+                    "exponent": round(float(exponent), 2),
+                    "superlinear": bool(exponent > SUPERLINEAR),
+                }
+            )
+    return report
+
+
+def compare(current, baseline_path):
+    """Print stage times and p50 latencies relative to an earlier run"""
+    with open(baseline_path) as f:
+        baseline = {r["transactions"]: r for r in json.load(f)["results"]}
+
+    for result in current["results"]:
+        before = baseline.get(result["transactions"])
+        if before is None:
+            continue
+        print(f"{result['transactions']:,} transactions (vs {baseline_path})")
+        for name, timing in result["stages"].items():
+            if name in before["stages"] and before["stages"][name]["seconds"] > 0:
+                ratio = timing["seconds"] / before["stages"][name]["seconds"]
+                print(f"  {name:<22} {timing['seconds']:>9.3f}s  x{ratio:.2f}")
+        for method, latency in result["methods"].items():
+            if method in before["methods"] and before["methods"][method]["p50_ms"] > 0:
+                ratio = latency["p50_ms"] / before["methods"][method]["p50_ms"]
+                print(
+                    f"  {method + ' p50':<22} {latency['p50_ms']:>8.3f}ms  x{ratio:.2f}"
+                )
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scales", nargs="+", type=int, default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--n", type=int, default=10)
+    parser.add_argument("--content-index", default="exact", choices=["exact", "ivf"])
+    parser.add_argument("--n-probe", type=int, default=8)
+    parser.add_argument(
+        "--build-workers", type=int, default=0, help="build threads, 0 for all cores"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for n_transactions in sorted(args.scales):
+        # A fresh process per scale keeps peak RSS figures independent
+        with context.Pool(1) as pool:
+            results.append(pool.apply(_run_scale_quietly, (n_transactions, args)))
+
+    report = {
+        "revision": git_revision(),
+        "created": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            key: value for key, value in vars(args).items() if key != "compare"
+        },
+        "results": results,
+        "scaling": scaling(results),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.output}")
+
+    for entry in report["scaling"]:
+        if entry["superlinear"]:
+            print(
+                f"WARNING: {entry['stage']} grows like n^{entry['exponent']} "
+                f"from {entry['from']:,} to {entry['to']:,} transactions"
+            )
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
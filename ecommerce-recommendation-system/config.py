@@ -5,7 +5,44 @@ class Config:
     SECRET_KEY = "your-secret-key-here"
     DATA_FILE = "data/ecommerce_data.csv"
     MODEL_PATH = "models/saved_models/"
+    ARTIFACT_PATH = "models/saved_models/artifacts/"
+    WARM_START = os.environ.get("WARM_START", "1") == "1"
+    # DEBUG also logs every recommendation request
+    LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+    # Pre-fork serving (gunicorn -c gunicorn.conf.py wsgi:app)
+    WEB_BIND = os.environ.get("WEB_BIND", "0.0.0.0:5000")
+    WEB_WORKERS = int(os.environ.get("WEB_WORKERS", os.cpu_count() or 1))
+
+    # Background rebuilds: seconds between scheduled ones (0 disables the
+    # schedule) and the token /admin endpoints require (unset disables them)
+    MODEL_REFRESH_INTERVAL = int(os.environ.get("MODEL_REFRESH_INTERVAL", 0))
+    ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+    # Pre-fork workers: seconds between checks for artifacts saved by the
+    # worker that rebuilt them
+    MODEL_RELOAD_INTERVAL = int(os.environ.get("MODEL_RELOAD_INTERVAL", 30))
 
     # Recommendation settings
     TOP_N_RECOMMENDATIONS = 10
     SIMILARITY_THRESHOLD = 0.7
+    # "exact" or "ivf" (approximate) content neighbors; more probes give
+    # better recall for slower builds
+    CONTENT_INDEX = os.environ.get("CONTENT_INDEX", "exact")
+    CONTENT_N_PROBE = int(os.environ.get("CONTENT_N_PROBE", 8))
+    # Threads used to build the models (0: one per core)
+    BUILD_WORKERS = int(os.environ.get("BUILD_WORKERS", 0))
+    # Weights of the scores blended by the hybrid method
+    HYBRID_WEIGHTS = {"collaborative": 0.6, "content": 0.3, "popularity": 0.1}
+    # Shared secret of shard servers and their coordinators (models/sharding.py)
+    SHARD_AUTHKEY = os.environ.get("SHARD_AUTHKEY", "")
+
+    # Precomputed recommendation store (see precompute.py)
+    REC_STORE_PATH = "models/saved_models/recommendations/"
+    REC_STORE_WIDTH = 20
+    SERVE_FROM_STORE = os.environ.get("SERVE_FROM_STORE", "0") == "1"
+
+    # In-process recommendation result cache
+    REC_CACHE_BYTES = int(os.environ.get("REC_CACHE_BYTES", 64 << 20))
+    REC_CACHE_TTL = int(os.environ.get("REC_CACHE_TTL", 300))
+    # Most active users whose recommendations are cached at startup
+    REC_CACHE_PREWARM = int(os.environ.get("REC_CACHE_PREWARM", 1000))
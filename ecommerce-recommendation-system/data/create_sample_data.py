@@ -1,304 +1,591 @@
+"""Synthetic Indian e-commerce transactions
+
+Everything is generated with NumPy from a seeded RNG, a chunk of
+transactions at a time, so datasets of 100M+ rows can be streamed to
+sharded files in bounded memory:
+
+    python data/create_sample_data.py
+    python data/create_sample_data.py --transactions 100000000 \\
+        --users 5000000 --products 500000 --shards data/shards --seed 7
+
+User activity and product popularity follow power laws. Transactions come
+in sessions of one user browsing nearby products of one category, and a
+share of purchases are repeats of a few favorite products per user.
+"""
+
+import argparse
+import os
+import numpy as np
 import pandas as pd
-from faker import Faker
-import random
 
+CATEGORIES = [
+    "Electronics",
+    "Clothing",
+    "Books",
+    "Home & Kitchen",
+    "Sports",
+    "Beauty",
+    "Groceries",
+    "Furniture",
+    "Mobile Phones",
+    "Fashion Accessories",
+]
 
-def generate_sample_data(num_users=1000, num_products=200, num_transactions=5000):
-    # Initialize Faker with Indian locale
-    fake = Faker("en_IN")
+# Indian brands by category
+INDIAN_BRANDS = {
+    "Electronics": [
+        "Samsung",
+        "Micromax",
+        "Lava",
+        "Intex",
+        "iBall",
+        "Onida",
+        "Videocon",
+        "BPL",
+    ],
+    "Clothing": [
+        "FabIndia",
+        "Biba",
+        "Manyavar",
+        "W",
+        "Allen Solly",
+        "Peter England",
+        "Raymond",
+        "Levis",
+    ],
+    "Books": [
+        "Arihant",
+        "S. Chand",
+        "NCERT",
+        "MBD",
+        "Oswaal",
+        "Upkar",
+        "GK Publications",
+    ],
+    "Home & Kitchen": [
+        "Prestige",
+        "Bajaj",
+        "Havells",
+        "Usha",
+        "Philips",
+        "Butterfly",
+        "Morphy Richards",
+    ],
+    "Sports": [
+        "Nike",
+        "Adidas",
+        "Puma",
+        "Reebok",
+        "Decathlon",
+        "Slazenger",
+        "Yonex",
+    ],
+    "Beauty": [
+        "Lakme",
+        "Maybelline",
+        "L'Oreal",
+        "Hindustan Unilever",
+        "Nivea",
+        "Ponds",
+        "Garnier",
+    ],
+    "Groceries": [
+        "Amul",
+        "Britannia",
+        "Parle",
+        "Dabur",
+        "Nestle",
+        "Cadbury",
+        "Haldiram",
+        "MTR",
+    ],
+    "Furniture": [
+        "Godrej",
+        "Nilkamal",
+        "Durian",
+        "Pepperfry",
+        "Urban Ladder",
+        "HomeTown",
+        "Ikea",
+    ],
+    "Mobile Phones": [
+        "Samsung",
+        "Xiaomi",
+        "Realme",
+        "Oppo",
+        "Vivo",
+        "OnePlus",
+        "Motorola",
+    ],
+    "Fashion Accessories": [
+        "Tanishq",
+        "PC Jeweller",
+        "Fastrack",
+        "Titan",
+        "Sonata",
+        "Maxima",
+    ],
+}
 
-    # Generate users with Indian names and locations
-    users = []
-    for i in range(num_users):
-        users.append(
-            {
-                "user_id": i + 1,
-                "name": fake.name(),
-                "age": random.randint(18, 65),
-                "gender": random.choice(["M", "F"]),
-                "location": fake.city(),
-                "state": fake.state(),
-                "email": fake.email(),
-                "phone_number": fake.phone_number(),
-            }
+# Indian product names by category
+INDIAN_PRODUCT_NAMES = {
+    "Electronics": [
+        "Smart TV",
+        "Washing Machine",
+        "Refrigerator",
+        "Air Conditioner",
+        "Laptop",
+        "Tablet",
+        "Smartphone",
+        "Headphones",
+    ],
+    "Clothing": [
+        "Kurta",
+        "Saree",
+        "Sherwani",
+        "Jeans",
+        "Shirt",
+        "Dress",
+        "T-shirt",
+        "Traditional Wear",
+    ],
+    "Books": [
+        "Competitive Exam Guide",
+        "Academic Textbook",
+        "Novel",
+        "Cookbook",
+        "Children's Book",
+        "Self-help Book",
+    ],
+    "Home & Kitchen": [
+        "Mixer Grinder",
+        "Pressure Cooker",
+        "Cookware Set",
+        "Dinner Set",
+        "Water Purifier",
+        "Iron",
+    ],
+    "Sports": [
+        "Cricket Bat",
+        "Football",
+        "Badminton Racket",
+        "Sports Shoes",
+        "Yoga Mat",
+        "Fitness Equipment",
+    ],
+    "Beauty": [
+        "Face Cream",
+        "Lipstick",
+        "Kajal",
+        "Shampoo",
+        "Perfume",
+        "Makeup Kit",
+        "Skin Care",
+    ],
+    "Groceries": [
+        "Biscuits",
+        "Chocolates",
+        "Snacks",
+        "Spices",
+        "Tea",
+        "Coffee",
+        "Ready-to-eat",
+    ],
+    "Furniture": [
+        "Sofa Set",
+        "Dining Table",
+        "Wardrobe",
+        "Bed",
+        "Office Chair",
+        "Bookshelf",
+    ],
+    "Mobile Phones": [
+        "Smartphone",
+        "Feature Phone",
+        "Tablet",
+        "Smart Watch",
+        "Earphones",
+    ],
+    "Fashion Accessories": [
+        "Necklace",
+        "Earrings",
+        "Watch",
+        "Bracelet",
+        "Sunglasses",
+        "Handbag",
+    ],
+}
+
+
+MALE_FIRST_NAMES = [
+    "Aarav",
+    "Vivaan",
+    "Aditya",
+    "Arjun",
+    "Rohan",
+    "Kabir",
+    "Ishaan",
+    "Rahul",
+    "Karan",
+    "Siddharth",
+    "Vikram",
+    "Amit",
+    "Rajesh",
+    "Suresh",
+    "Manoj",
+    "Nikhil",
+]
+FEMALE_FIRST_NAMES = [
+    "Aadhya",
+    "Ananya",
+    "Diya",
+    "Isha",
+    "Kavya",
+    "Meera",
+    "Priya",
+    "Riya",
+    "Saanvi",
+    "Neha",
+    "Pooja",
+    "Sneha",
+    "Divya",
+    "Lakshmi",
+    "Anjali",
+    "Shreya",
+]
+LAST_NAMES = [
+    "Sharma",
+    "Verma",
+    "Patel",
+    "Reddy",
+    "Nair",
+    "Iyer",
+    "Gupta",
+    "Singh",
+    "Kumar",
+    "Das",
+    "Mehta",
+    "Joshi",
+    "Chopra",
+    "Bose",
+    "Kulkarni",
+    "Menon",
+]
+CITIES = [
+    ("Mumbai", "Maharashtra"),
+    ("Pune", "Maharashtra"),
+    ("Delhi", "Delhi"),
+    ("Bengaluru", "Karnataka"),
+    ("Hyderabad", "Telangana"),
+    ("Chennai", "Tamil Nadu"),
+    ("Kolkata", "West Bengal"),
+    ("Ahmedabad", "Gujarat"),
+    ("Jaipur", "Rajasthan"),
+    ("Lucknow", "Uttar Pradesh"),
+    ("Kochi", "Kerala"),
+    ("Chandigarh", "Punjab"),
+    ("Bhopal", "Madhya Pradesh"),
+    ("Patna", "Bihar"),
+    ("Bhubaneswar", "Odisha"),
+    ("Guwahati", "Assam"),
+]
+PAYMENT_METHODS = [
+    "Credit Card",
+    "Debit Card",
+    "UPI",
+    "Net Banking",
+    "Cash on Delivery",
+]
+DELIVERY_STATUSES = ["Delivered", "Shipped", "Processing", "Cancelled"]
+DESCRIPTION_WORDS = [
+    "premium",
+    "durable",
+    "lightweight",
+    "classic",
+    "modern",
+    "eco-friendly",
+    "handcrafted",
+    "bestselling",
+    "compact",
+    "stylish",
+    "affordable",
+    "trusted",
+    "authentic",
+    "everyday",
+    "festive",
+    "long-lasting",
+]
+
+# Jan, Apr, Aug, Oct, Nov - major Indian festivals
+FESTIVAL_MONTHS = [1, 4, 8, 10, 11]
+
+# Transaction ratings (Indians tend to rate higher)
+RATING_WEIGHTS = {3: 3, 4: 4, 5: 2, 2: 1, 1: 1}
+
+
+class SampleDataGenerator:
+    """Seeded, vectorized generator of transactions merged with products and users
+
+    Product and user attributes are drawn once as compact arrays; every
+    chunk of transactions only indexes into them, so memory depends on the
+    number of users and products and the chunk size, not on the total
+    number of transactions.
+    """
+
+    def __init__(
+        self,
+        num_users=1000,
+        num_products=200,
+        seed=None,
+        user_exponent=0.8,
+        product_exponent=0.9,
+        mean_session_length=3,
+        repeat_rate=0.2,
+        end_date=None,
+    ):
+        self.num_users = num_users
+        self.num_products = num_products
+        self.seed = seed
+        self.mean_session_length = mean_session_length
+        self.repeat_rate = repeat_rate
+        self.end_date = pd.Timestamp(end_date or pd.Timestamp.now()).floor("s")
+        self.rng = np.random.default_rng(seed)
+
+        self.user_weights = self._power_law(num_users, user_exponent)
+        self.product_weights = self._power_law(num_products, product_exponent)
+        self._products()
+        self._users()
+
+    def _power_law(self, n, exponent):
+        """Cumulative Zipf weights over a random ordering of ``n`` ids
+
+        Sampling is a ``searchsorted`` of uniform numbers, which maps to a
+        rank; ``order`` maps ranks to ids so popularity is not tied to id.
+        """
+        weights = np.arange(1, n + 1, dtype=np.float64) ** -exponent
+        cumulative = np.cumsum(weights)
+        cumulative /= cumulative[-1]
+        return cumulative, self.rng.permutation(n)
+
+    def _sample(self, weights, uniforms):
+        cumulative, order = weights
+        ranks = np.minimum(np.searchsorted(cumulative, uniforms), len(order) - 1)
+        return order[ranks]
+
+    def _products(self):
+        rng, n = self.rng, self.num_products
+
+        # Products are laid out in contiguous id ranges per category, so
+        # "nearby" ids are similar products
+        category_counts = rng.multinomial(
+            n, np.full(len(CATEGORIES), 1 / len(CATEGORIES))
+        )
+        self.product_category = np.repeat(np.arange(len(CATEGORIES)), category_counts)
+        self.category_start = np.concatenate([[0], np.cumsum(category_counts)[:-1]])
+        self.category_end = np.cumsum(category_counts)
+
+        brand_pick = rng.random(n)
+        name_pick = rng.random(n)
+        brands, names, descriptions = [], [], []
+        words = rng.integers(0, len(DESCRIPTION_WORDS), (n, 2))
+        for i, category in enumerate(self.product_category):
+            category_name = CATEGORIES[category]
+            brand_options = INDIAN_BRANDS.get(category_name, ["Generic"])
+            name_options = INDIAN_PRODUCT_NAMES.get(category_name, ["Product"])
+            brand = brand_options[int(brand_pick[i] * len(brand_options))]
+            base = name_options[int(name_pick[i] * len(name_options))]
+            brands.append(brand)
+            names.append(f"{brand} {base} {i + 1}")
+            descriptions.append(
+                f"{DESCRIPTION_WORDS[words[i, 0]].capitalize()} "
+                f"{DESCRIPTION_WORDS[words[i, 1]]} {base.lower()} from {brand}."
+            )
+
+        self.product_brand = pd.Categorical(brands)
+        self.product_name = np.array(names, dtype=object)
+        self.product_description = np.array(descriptions, dtype=object)
+        self.product_price = np.round(rng.uniform(199, 99999, n), 2)
+        self.product_rating = np.round(rng.uniform(3.0, 5.0, n), 1)
+        self.product_discount = rng.integers(0, 71, n)
+        self.product_in_stock = rng.random(n) < 0.75
+        self.product_quality = rng.normal(0, 0.5, n)
+
+    def _users(self):
+        rng, n = self.rng, self.num_users
+        self.user_gender = rng.integers(0, 2, n)
+        self.user_first = rng.integers(0, len(MALE_FIRST_NAMES), n) + np.where(
+            self.user_gender == 1, len(MALE_FIRST_NAMES), 0
         )
+        self.user_last = rng.integers(0, len(LAST_NAMES), n)
+        self.user_city = rng.integers(0, len(CITIES), n)
+        self.user_age = rng.integers(18, 66, n)
+        self.user_bias = rng.normal(0, 0.5, n)
+        self.user_phone = rng.integers(6_000_000_000, 9_999_999_999, n)
+
+        first_names = MALE_FIRST_NAMES + FEMALE_FIRST_NAMES
+        self.full_names = [
+            f"{first} {last}" for first in first_names for last in LAST_NAMES
+        ]
+
+    def _favorites(self, users, slots):
+        """The ``slots``-th favorite product of each user, derived from the user id
+
+        Stateless, so repeat purchases stay consistent across chunks.
+        """
+        keys = (
+            users.astype(np.uint64) * np.uint64(2654435761)
+            + slots.astype(np.uint64) * np.uint64(40503)
+        ) % np.uint64(2**32)
+        return self._sample(self.product_weights, keys.astype(np.float64) / 2**32)
 
-    # Generate products with Indian context
-    categories = [
-        "Electronics",
-        "Clothing",
-        "Books",
-        "Home & Kitchen",
-        "Sports",
-        "Beauty",
-        "Groceries",
-        "Furniture",
-        "Mobile Phones",
-        "Fashion Accessories",
-    ]
-
-    # Indian brands by category
-    indian_brands = {
-        "Electronics": [
-            "Samsung",
-            "Micromax",
-            "Lava",
-            "Intex",
-            "iBall",
-            "Onida",
-            "Videocon",
-            "BPL",
-        ],
-        "Clothing": [
-            "FabIndia",
-            "Biba",
-            "Manyavar",
-            "W",
-            "Allen Solly",
-            "Peter England",
-            "Raymond",
-            "Levis",
-        ],
-        "Books": [
-            "Arihant",
-            "S. Chand",
-            "NCERT",
-            "MBD",
-            "Oswaal",
-            "Upkar",
-            "GK Publications",
-        ],
-        "Home & Kitchen": [
-            "Prestige",
-            "Bajaj",
-            "Havells",
-            "Usha",
-            "Philips",
-            "Butterfly",
-            "Morphy Richards",
-        ],
-        "Sports": [
-            "Nike",
-            "Adidas",
-            "Puma",
-            "Reebok",
-            "Decathlon",
-            "Slazenger",
-            "Yonex",
-        ],
-        "Beauty": [
-            "Lakme",
-            "Maybelline",
-            "L'Oreal",
-            "Hindustan Unilever",
-            "Nivea",
-            "Ponds",
-            "Garnier",
-        ],
-        "Groceries": [
-            "Amul",
-            "Britannia",
-            "Parle",
-            "Dabur",
-            "Nestle",
-            "Cadbury",
-            "Haldiram",
-            "MTR",
-        ],
-        "Furniture": [
-            "Godrej",
-            "Nilkamal",
-            "Durian",
-            "Pepperfry",
-            "Urban Ladder",
-            "HomeTown",
-            "Ikea",
-        ],
-        "Mobile Phones": [
-            "Samsung",
-            "Xiaomi",
-            "Realme",
-            "Oppo",
-            "Vivo",
-            "OnePlus",
-            "Motorola",
-        ],
-        "Fashion Accessories": [
-            "Tanishq",
-            "PC Jeweller",
-            "Fastrack",
-            "Titan",
-            "Sonata",
-            "Maxima",
-        ],
-    }
-
-    # Indian product names by category
-    indian_product_names = {
-        "Electronics": [
-            "Smart TV",
-            "Washing Machine",
-            "Refrigerator",
-            "Air Conditioner",
-            "Laptop",
-            "Tablet",
-            "Smartphone",
-            "Headphones",
-        ],
-        "Clothing": [
-            "Kurta",
-            "Saree",
-            "Sherwani",
-            "Jeans",
-            "Shirt",
-            "Dress",
-            "T-shirt",
-            "Traditional Wear",
-        ],
-        "Books": [
-            "Competitive Exam Guide",
-            "Academic Textbook",
-            "Novel",
-            "Cookbook",
-            "Children's Book",
-            "Self-help Book",
-        ],
-        "Home & Kitchen": [
-            "Mixer Grinder",
-            "Pressure Cooker",
-            "Cookware Set",
-            "Dinner Set",
-            "Water Purifier",
-            "Iron",
-        ],
-        "Sports": [
-            "Cricket Bat",
-            "Football",
-            "Badminton Racket",
-            "Sports Shoes",
-            "Yoga Mat",
-            "Fitness Equipment",
-        ],
-        "Beauty": [
-            "Face Cream",
-            "Lipstick",
-            "Kajal",
-            "Shampoo",
-            "Perfume",
-            "Makeup Kit",
-            "Skin Care",
-        ],
-        "Groceries": [
-            "Biscuits",
-            "Chocolates",
-            "Snacks",
-            "Spices",
-            "Tea",
-            "Coffee",
-            "Ready-to-eat",
-        ],
-        "Furniture": [
-            "Sofa Set",
-            "Dining Table",
-            "Wardrobe",
-            "Bed",
-            "Office Chair",
-            "Bookshelf",
-        ],
-        "Mobile Phones": [
-            "Smartphone",
-            "Feature Phone",
-            "Tablet",
-            "Smart Watch",
-            "Earphones",
-        ],
-        "Fashion Accessories": [
-            "Necklace",
-            "Earrings",
-            "Watch",
-            "Bracelet",
-            "Sunglasses",
-            "Handbag",
-        ],
-    }
-
-    products = []
-    for i in range(num_products):
-        category = random.choice(categories)
-        brand = random.choice(indian_brands.get(category, ["Generic"]))
-        product_name_base = random.choice(
-            indian_product_names.get(category, ["Product"])
+    def _session_timestamps(self, n_sessions):
+        """Session start times over the past year, busier in festival months"""
+        days = pd.date_range(end=self.end_date.normalize(), periods=365, freq="D")
+        weights = np.where(days.month.isin(FESTIVAL_MONTHS), 1.5, 1.0)
+        day = self.rng.choice(len(days), n_sessions, p=weights / weights.sum())
+        seconds = self.rng.integers(0, 86400, n_sessions)
+        return days.values[day] + seconds.astype("timedelta64[s]")
+
+    def chunk(self, n_transactions, first_transaction_id=1):
+        """One chunk of ``n_transactions`` merged transaction rows"""
+        rng = self.rng
+
+        # Sessions: one user, a few transactions minutes apart
+        lengths = rng.geometric(1 / self.mean_session_length, n_transactions)
+        lengths = lengths[: np.searchsorted(np.cumsum(lengths), n_transactions) + 1]
+        lengths[-1] -= lengths.sum() - n_transactions
+        session = np.repeat(np.arange(len(lengths)), lengths)
+        position = np.arange(n_transactions) - np.repeat(
+            np.cumsum(lengths) - lengths, lengths
         )
 
-        products.append(
-            {
-                "product_id": i + 1,
-                "product_name": f"{brand} {product_name_base} {i + 1}",
-                "category": category,
-                "price": round(random.uniform(199, 99999), 2),
-                "brand": brand,
-                "rating": round(random.uniform(3.0, 5.0), 1),
-                "description": fake.text(max_nb_chars=100),
-                "discount": random.randint(0, 70),
-                "in_stock": random.choice([True, True, True, False]),
-            }
+        session_users = self._sample(self.user_weights, rng.random(len(lengths)))
+        users = session_users[session]
+
+        # The first product of a session follows popularity; later ones
+        # browse nearby products of the same category
+        anchors = self._sample(self.product_weights, rng.random(len(lengths)))[session]
+        category = self.product_category[anchors]
+        browsed = np.clip(
+            anchors + rng.integers(-5, 6, n_transactions),
+            self.category_start[category],
+            self.category_end[category] - 1,
         )
+        products = np.where(position == 0, anchors, browsed)
 
-    # Generate transactions with Indian context
-    transactions = []
-    for i in range(num_transactions):
-        user_id = random.randint(1, num_users)
-        product_id = random.randint(1, num_products)
+        # Some purchases are repeats of the user's favorites
+        repeat = rng.random(n_transactions) < self.repeat_rate
+        favorites = self._favorites(users, rng.integers(0, 5, n_transactions))
+        products = np.where(repeat, favorites, products)
 
-        # Add rating to transactions (Indians tend to rate higher)
-        rating = random.choices([3, 4, 5, 2, 1], weights=[3, 4, 2, 1, 1])[0]
+        # Ratings lean on product quality and how generous the user is
+        rating_weights = np.array(list(RATING_WEIGHTS.values()), dtype=np.float64)
+        base_rating = rng.choice(
+            list(RATING_WEIGHTS),
+            n_transactions,
+            p=rating_weights / rating_weights.sum(),
+        )
+        noise = self.product_quality[products] + self.user_bias[users]
+        rating = np.clip(np.rint(base_rating + noise), 1, 5).astype(np.int8)
+
+        timestamp = self._session_timestamps(len(lengths))[session] + (
+            position * rng.integers(30, 600, n_transactions)
+        ).astype("timedelta64[s]")
+        purchase_count = 1 + rng.binomial(2, 0.25, n_transactions)
+        discount = self.product_discount[products]
+        price = self.product_price[products]
+
+        name_codes = self.user_first[users] * len(LAST_NAMES) + self.user_last[users]
+        name = pd.Categorical.from_codes(name_codes, self.full_names)
+        city = self.user_city[users]
+        user_ids = pd.Series(users + 1)
 
-        transactions.append(
+        df = pd.DataFrame(
             {
-                "transaction_id": i + 1,
-                "user_id": user_id,
-                "product_id": product_id,
-                "rating": rating,
-                "timestamp": fake.date_time_between(start_date="-1y", end_date="now"),
-                "purchase_count": random.randint(1, 3),
-                "amount": round(
-                    random.uniform(199, 19999), 2
-                ),  # Transaction amount in INR
-                "payment_method": random.choice(
-                    [
-                        "Credit Card",
-                        "Debit Card",
-                        "UPI",
-                        "Net Banking",
-                        "Cash on Delivery",
-                    ]
+                "transaction_id": np.arange(
+                    first_transaction_id, first_transaction_id + n_transactions
+                ),
+                "user_id": users + 1,
+                "product_id": products + 1,
+                "rating_x": rating,
+                "timestamp": timestamp,
+                "purchase_count": purchase_count,
+                "amount": np.round(price * (1 - discount / 100) * purchase_count, 2),
+                "payment_method": pd.Categorical.from_codes(
+                    rng.integers(0, len(PAYMENT_METHODS), n_transactions),
+                    PAYMENT_METHODS,
+                ),
+                "delivery_status": pd.Categorical.from_codes(
+                    rng.choice(
+                        len(DELIVERY_STATUSES), n_transactions, p=[0.7, 0.15, 0.1, 0.05]
+                    ),
+                    DELIVERY_STATUSES,
+                ),
+                "product_name": self.product_name[products],
+                "category": pd.Categorical.from_codes(
+                    self.product_category[products], CATEGORIES
                 ),
-                "delivery_status": random.choice(
-                    ["Delivered", "Shipped", "Processing", "Cancelled"]
+                "price": price,
+                "brand": self.product_brand[products],
+                "rating_y": self.product_rating[products],
+                "description": self.product_description[products],
+                "discount": discount,
+                "in_stock": self.product_in_stock[products],
+                "name": name,
+                "age": self.user_age[users],
+                "gender": np.where(self.user_gender[users] == 0, "M", "F"),
+                "location": pd.Categorical.from_codes(city, [c for c, _ in CITIES]),
+                "state": pd.Categorical(np.array([s for _, s in CITIES])[city]),
+                "email": (
+                    pd.Series(name).str.lower().str.replace(" ", ".", regex=False)
+                    + user_ids.astype(str)
+                    + "@example.com"
                 ),
+                "phone_number": "+91" + pd.Series(self.user_phone[users]).astype(str),
             }
         )
+        df["is_festive_season"] = df["timestamp"].dt.month.isin(FESTIVAL_MONTHS)
+        return df
 
-    # Create DataFrames
-    transactions_df = pd.DataFrame(transactions)
-    products_df = pd.DataFrame(products)
-    users_df = pd.DataFrame(users)
+    def chunks(self, num_transactions, chunk_size=1_000_000):
+        """Yield ``num_transactions`` rows as frames of at most ``chunk_size``"""
+        for start in range(0, num_transactions, chunk_size):
+            yield self.chunk(min(chunk_size, num_transactions - start), start + 1)
 
-    # Merge data
-    df = transactions_df.merge(products_df, on="product_id")
-    df = df.merge(users_df, on="user_id")
 
-    # Add some Indian festival season spikes
-    festival_months = [
-        1,
-        4,
-        8,
-        10,
-        11,
-    ]  # Jan, Apr, Aug, Oct, Nov - major Indian festivals
-    df["is_festive_season"] = df["timestamp"].dt.month.isin(festival_months)
+def generate_sample_data(
+    num_users=1000, num_products=200, num_transactions=5000, seed=None
+):
+    """Generate a transactions frame merged with product and user details"""
+    generator = SampleDataGenerator(num_users, num_products, seed=seed)
+    return pd.concat(generator.chunks(num_transactions), ignore_index=True)
 
-    return df
+
+def write_shards(
+    output_dir,
+    num_users,
+    num_products,
+    num_transactions,
+    shard_size=1_000_000,
+    file_format="parquet",
+    seed=None,
+):
+    """Stream generated transactions to ``part-NNNNN`` files in ``output_dir``
+
+    Only one shard is in memory at a time. Returns the written paths.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    generator = SampleDataGenerator(num_users, num_products, seed=seed)
+    paths = []
+    for shard, df in enumerate(generator.chunks(num_transactions, shard_size)):
+        path = os.path.join(output_dir, f"part-{shard:05d}.{file_format}")
+        if file_format == "parquet":
+            df.to_parquet(path, index=False)
+        else:
+            df.to_csv(path, index=False)
+        paths.append(path)
+        print(f"Wrote {path} ({len(df):,} transactions)")
+    return paths
 
 
 def display_sample_data(df):
@@ -332,7 +619,7 @@ def display_sample_data(df):
             "transaction_id",
             "user_id",
             "product_id",
-            "rating",
+            "rating_x",
             "amount",
             "payment_method",
         ]
@@ -351,20 +638,43 @@ def display_sample_data(df):
     print(f"Avg: ₹{df['price'].mean():.2f}")
 
     print("\nRating Distribution:")
-    print(df["rating"].value_counts().sort_index())
+    print(df["rating_x"].value_counts().sort_index())
 
     print("\nMissing Values:")
     print(df.isnull().sum())
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate sample e-commerce data")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument("--transactions", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--shards", help="directory to stream sharded output to")
+    parser.add_argument("--shard-size", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=["parquet", "csv"], default="parquet")
+    args = parser.parse_args()
+
     print("Generating Indian E-commerce Sample Data...")
-    df = generate_sample_data()
+    if args.shards:
+        write_shards(
+            args.shards,
+            args.users,
+            args.products,
+            args.transactions,
+            args.shard_size,
+            args.format,
+            args.seed,
+        )
+    else:
+        df = generate_sample_data(
+            args.users, args.products, args.transactions, seed=args.seed
+        )
 
-    # Save to CSV
-    df.to_csv("data/ecommerce_data.csv", index=False)
+        # Save to CSV
+        df.to_csv("data/ecommerce_data.csv", index=False)
 
-    # Display sample data
-    display_sample_data(df)
+        # Display sample data
+        display_sample_data(df)
 
-    print(f"\nData successfully saved to 'data/ecommerce_data.csv'")
+        print(f"\nData successfully saved to 'data/ecommerce_data.csv'")
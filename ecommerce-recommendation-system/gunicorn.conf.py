@@ -0,0 +1,23 @@
+"""Gunicorn settings for serving with several workers
+
+gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import gc
+from config import Config
+
+bind = Config.WEB_BIND
+workers = Config.WEB_WORKERS
+# Load the models once in the master and fork the workers from it
+preload_app = True
+timeout = 120
+
+
+def post_fork(server, worker):
+    gc.enable()
+    # Threads do not survive the fork. Each worker runs its own schedule,
+    # but a rebuild holds the artifact build lock: the first worker to find
+    # the artifacts stale rebuilds them and the others only load the result
+    from app import manager
+
+    manager.start()
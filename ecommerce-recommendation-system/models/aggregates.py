@@ -0,0 +1,118 @@
+import threading
+import numpy as np
+
+
+class DashboardAggregates:
+    """Dashboard and stats figures, computed once per data version
+
+    ``DataProcessor.version`` changes whenever the transactions change (a
+    reload or an ``ingest``). Readers get the cached figures until then, so
+    dashboard traffic costs a version check instead of full-frame passes.
+    """
+
+    def __init__(self, data_processor, n_top_products=5):
+        self.dp = data_processor
+        self.n_top_products = n_top_products
+        self._version = None
+        self._values = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Current aggregates, recomputed if the data changed since last time"""
+        values = self._values
+        if values is not None and self._version == self.dp.version:
+            return values
+
+        with self._lock:
+            # Another request may have refreshed them while we waited
+            if self._values is None or self._version != self.dp.version:
+                # Reading df may load it and bump the version, so take the
+                # version afterwards
+                df = self.dp.df
+                version = self.dp.version
+                self._values = self.compute(df, self.n_top_products)
+                self._version = version
+            return self._values
+
+    def stats(self):
+        """The headline totals served by ``/api/stats``"""
+        return self.get()["stats"]
+
+    def invalidate(self):
+        self._values = None
+
+    @staticmethod
+    def compute(df, n_top_products=5):
+        """Compute every aggregate from the transactions frame in one go"""
+        product_codes, product_ids = _codes(df["product_id"])
+        user_codes, user_ids = _codes(df["user_id"])
+        n_products = len(product_ids)
+
+        stats = {
+            "total_users": len(user_ids),
+            "total_products": n_products,
+            "total_transactions": len(df),
+            "average_rating": round(float(df["rating"].mean()), 2),
+        }
+
+        # Top products by units sold; ties keep the lowest product id first
+        purchases = np.bincount(
+            product_codes,
+            weights=df["purchase_count"].to_numpy(dtype=np.float64),
+            minlength=n_products,
+        )
+        rating_sums = np.bincount(
+            product_codes,
+            weights=df["rating"].to_numpy(dtype=np.float64),
+            minlength=n_products,
+        )
+        rating_counts = np.bincount(product_codes, minlength=n_products)
+        top = np.argsort(-purchases, kind="stable")[:n_top_products]
+
+        # Row of the first transaction of each top product, for its details
+        first_rows = np.full(n_products, len(df), dtype=np.int64)
+        np.minimum.at(first_rows, product_codes, np.arange(len(df)))
+        details = df.iloc[first_rows[top]]
+
+        top_products = [
+            {
+                "product_id": int(product_ids[code]),
+                "product_name": str(row["product_name"]),
+                "category": str(row["category"]),
+                "rating": float(rating_sums[code] / rating_counts[code]),
+                "purchase_count": int(purchases[code]),
+                "price": float(row["price"]),
+                "brand": str(row["brand"]) if "brand" in row else "Generic",
+            }
+            for code, row in zip(top, details.to_dict("records"))
+        ]
+
+        category_counts = df["category"].value_counts(sort=False).sort_index()
+        category_dist = [
+            {"category": str(category), "count": int(count)}
+            for category, count in category_counts.items()
+            if count > 0
+        ]
+
+        # Distinct products per user, from the unique (user, product) pairs
+        pairs = np.unique(user_codes.astype(np.int64) * n_products + product_codes)
+        insights = {
+            "avg_price": float(df["price"].mean()),
+            "top_category": (
+                str(category_counts.idxmax()) if len(category_counts) else ""
+            ),
+            "avg_products_per_user": len(pairs) / max(len(user_ids), 1),
+        }
+
+        return {
+            "stats": stats,
+            "top_products": top_products,
+            "category_dist": category_dist,
+            "insights": insights,
+        }
+
+
+def _codes(column):
+    """Dense codes of a column and the sorted unique values they index"""
+    values, codes = np.unique(column.to_numpy(), return_inverse=True)
+    return codes.ravel(), values
@@ -0,0 +1,163 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from models.parallel import thread_pool
+
+
+class ImplicitALS:
+    """Matrix factorization of implicit feedback by alternating least squares
+
+    Follows Hu, Koren and Volinsky: every observed (user, item) pair is a
+    preference of 1 with confidence ``1 + alpha * weight``, unobserved pairs
+    are a preference of 0 with confidence 1. Each half-step solves all the
+    users (or items) at once with a few conjugate gradient iterations, so
+    the cost is O(nnz * factors) per step and nothing is built per row.
+    Rows are solved in blocks of ``block_size`` on ``n_jobs`` threads, which
+    bounds the O(nnz * factors) temporaries by the block rather than the
+    whole matrix.
+    """
+
+    def __init__(
+        self,
+        factors=32,
+        regularization=0.1,
+        alpha=1.0,
+        iterations=15,
+        cg_steps=3,
+        random_state=42,
+        block_size=8192,
+        n_jobs=1,
+    ):
+        self.factors = factors
+        self.regularization = regularization
+        self.alpha = alpha
+        self.iterations = iterations
+        self.cg_steps = cg_steps
+        self.random_state = random_state
+        self.block_size = block_size
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.user_factors = None
+        self.item_factors = None
+
+    def fit(self, weights, pool=None):
+        """Train on a sparse ``(n_users, n_items)`` matrix of interaction weights
+
+        ``pool`` is a thread pool to solve the blocks on instead of a new one.
+        """
+        weights = sp.csr_matrix(weights, dtype=np.float32)
+        weights_t = weights.T.tocsr()
+        n_users, n_items = weights.shape
+
+        rng = np.random.default_rng(self.random_state)
+        scale = 0.01
+        self.user_factors = (
+            rng.standard_normal((n_users, self.factors)) * scale
+        ).astype(np.float32)
+        self.item_factors = (
+            rng.standard_normal((n_items, self.factors)) * scale
+        ).astype(np.float32)
+
+        for _ in range(self.iterations):
+            self._solve(weights, self.item_factors, self.user_factors, pool=pool)
+            self._solve(weights_t, self.user_factors, self.item_factors, pool=pool)
+        return self
+
+    def fold_in(self, weights, user_codes):
+        """Re-solve the factors of ``user_codes`` against fixed item factors
+
+        ``weights`` is the full interaction matrix; rows beyond the current
+        factors (new users) are added first.
+        """
+        n_new = weights.shape[0] - len(self.user_factors)
+        n_new_items = weights.shape[1] - len(self.item_factors)
+        self.user_factors = np.concatenate(
+            [self.user_factors, np.zeros((n_new, self.factors), np.float32)]
+        )
+        # New items have no factors until the next full fit
+        self.item_factors = np.concatenate(
+            [self.item_factors, np.zeros((n_new_items, self.factors), np.float32)]
+        )
+
+        user_codes = np.unique(user_codes)
+        rows = sp.csr_matrix(weights, dtype=np.float32)[user_codes]
+        factors = self.user_factors[user_codes]
+        self._solve(rows, self.item_factors, factors, steps=self.cg_steps * 2)
+        self.user_factors[user_codes] = factors
+
+    def _solve(self, weights, fixed, factors, steps=None, pool=None):
+        """Update ``factors`` in place given the ``fixed`` side
+
+        Runs conjugate gradient on every row's normal equations
+        ``(Y^T C_u Y + reg * I) x_u = Y^T C_u p_u``, warm-started from the
+        current factors. Rows are independent, so each block of rows is
+        solved separately.
+        """
+        gram = fixed.T @ fixed + self.regularization * np.eye(
+            self.factors, dtype=np.float32
+        )
+        starts = range(0, weights.shape[0], self.block_size)
+
+        def solve_block(start):
+            stop = start + self.block_size
+            # Slices of the factors are views, so the block updates in place
+            self._solve_block(
+                weights[start:stop], fixed, gram, factors[start:stop], steps
+            )
+
+        if pool is None and (self.n_jobs == 1 or len(starts) <= 1):
+            for start in starts:
+                solve_block(start)
+        else:
+            with thread_pool(min(self.n_jobs, len(starts)), pool) as pool:
+                pool.map(solve_block, starts, chunksize=1)
+
+    def _solve_block(self, weights, fixed, gram, factors, steps):
+        rows = np.repeat(np.arange(weights.shape[0]), np.diff(weights.indptr))
+        cols = weights.indices
+        extra = (self.alpha * weights.data).astype(np.float32)
+
+        def product(x):
+            # (Y^T Y + reg * I) x plus the observed items' extra confidence
+            dots = np.einsum("ij,ij->i", fixed[cols], x[rows]) * extra
+            correction = sp.csr_matrix(
+                (dots, cols, weights.indptr), shape=weights.shape
+            )
+            return x @ gram + correction @ fixed
+
+        target = (
+            sp.csr_matrix((1 + extra, cols, weights.indptr), shape=weights.shape)
+            @ fixed
+        )
+        residual = target - product(factors)
+        direction = residual.copy()
+        residual_norm = np.einsum("ij,ij->i", residual, residual)
+
+        for _ in range(steps or self.cg_steps):
+            projected = product(direction)
+            curvature = np.einsum("ij,ij->i", direction, projected)
+            step = np.divide(
+                residual_norm,
+                curvature,
+                out=np.zeros_like(residual_norm),
+                where=curvature > 1e-12,
+            )
+            factors += step[:, None] * direction
+            residual -= step[:, None] * projected
+
+            new_norm = np.einsum("ij,ij->i", residual, residual)
+            ratio = np.divide(
+                new_norm,
+                residual_norm,
+                out=np.zeros_like(new_norm),
+                where=residual_norm > 1e-12,
+            )
+            direction = residual + ratio[:, None] * direction
+            residual_norm = new_norm
+
+    def scores(self, user_codes):
+        """Predicted preference of every item for each of ``user_codes``"""
+        return self.user_factors[user_codes] @ self.item_factors.T
+
+    @property
+    def nbytes(self):
+        return self.user_factors.nbytes + self.item_factors.nbytes
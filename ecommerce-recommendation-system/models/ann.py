@@ -0,0 +1,204 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from sklearn.decomposition import TruncatedSVD
+from models.parallel import thread_pool
+
+
+class IVFIndex:
+    """Inverted-file approximate nearest neighbor index over dense embeddings
+
+    Sparse vectors (e.g. TF-IDF) are projected to ``n_components`` dense,
+    unit-length dimensions with a truncated SVD and clustered with
+    spherical k-means into ``n_lists`` lists. A query is only compared with
+    the members of its ``n_probe`` closest lists: more probes mean better
+    recall and slower queries, ``n_probe == n_lists`` is an exact search.
+    """
+
+    def __init__(
+        self,
+        n_components=64,
+        n_lists=None,
+        n_probe=8,
+        n_iter=10,
+        n_jobs=None,
+        random_state=42,
+    ):
+        self.n_components = n_components
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.random_state = random_state
+        self.components = None
+        self.embeddings = None
+        self.centroids = None
+        self.list_offsets = None
+        self.list_items = None
+
+    @classmethod
+    def from_arrays(cls, components, embeddings, centroids, list_offsets, list_items):
+        """Wrap saved index arrays, e.g. memory-mapped ones"""
+        index = cls(n_components=components.shape[0], n_lists=len(centroids))
+        index.components = components
+        index.embeddings = embeddings
+        index.centroids = centroids
+        index.list_offsets = list_offsets
+        index.list_items = list_items
+        return index
+
+    def fit(self, vectors, pool=None):
+        """Embed ``vectors`` and build the inverted lists
+
+        ``pool`` is a thread pool to run the blocks on instead of a new one.
+        """
+        vectors = sp.csr_matrix(vectors, dtype=np.float32)
+        n_rows = vectors.shape[0]
+        n_components = max(1, min(self.n_components, vectors.shape[1] - 1, n_rows - 1))
+
+        svd = TruncatedSVD(n_components, random_state=self.random_state)
+        svd.fit(vectors)
+        self.components = svd.components_.astype(np.float32)
+        self.embeddings = self.embed(vectors)
+
+        n_lists = self.n_lists or int(np.sqrt(n_rows))
+        self.centroids = self._kmeans(
+            self.embeddings, max(1, min(n_lists, n_rows)), pool
+        )
+        self._build_lists(self._assign(self.embeddings, pool=pool))
+        return self
+
+    def embed(self, vectors):
+        """Unit-length dense embeddings of sparse ``vectors``"""
+        embeddings = np.asarray(vectors @ self.components.T, dtype=np.float32)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return np.divide(
+            embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0
+        )
+
+    def add(self, vectors):
+        """Append new rows to the index using the fitted projection and lists"""
+        embeddings = self.embed(sp.csr_matrix(vectors, dtype=np.float32))
+        assignment = np.empty(len(self.embeddings), dtype=np.int64)
+        assignment[self.list_items] = np.repeat(
+            np.arange(len(self.centroids)), np.diff(self.list_offsets)
+        )
+        self.embeddings = np.concatenate([self.embeddings, embeddings])
+        self._build_lists(np.concatenate([assignment, self._assign(embeddings)]))
+
+    def _kmeans(self, embeddings, n_lists, pool=None):
+        """Spherical k-means; empty lists are reseeded with random rows"""
+        rng = np.random.default_rng(self.random_state)
+        centroids = embeddings[rng.choice(len(embeddings), n_lists, replace=False)]
+
+        for _ in range(self.n_iter):
+            assignment = self._assign(embeddings, centroids, pool=pool)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, embeddings)
+            empty = np.bincount(assignment, minlength=n_lists) == 0
+            sums[empty] = embeddings[rng.choice(len(embeddings), empty.sum())]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+        return centroids
+
+    def _assign(self, embeddings, centroids=None, block_size=65536, pool=None):
+        """Closest centroid of every embedding, in parallel blocks"""
+        centroids = self.centroids if centroids is None else centroids
+
+        def assign_block(start):
+            block = embeddings[start : start + block_size]
+            return np.argmax(block @ centroids.T, axis=1)
+
+        starts = range(0, len(embeddings), block_size)
+        with thread_pool(self.n_jobs, pool) as pool:
+            return np.concatenate(pool.map(assign_block, starts)).astype(np.int64)
+
+    def _build_lists(self, assignment):
+        self.list_items = np.argsort(assignment, kind="stable").astype(np.int32)
+        counts = np.bincount(assignment, minlength=len(self.centroids))
+        self.list_offsets = np.zeros(len(self.centroids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.list_offsets[1:])
+
+    def candidates(self, row_ids, n_probe=None, n_candidates=200, vectors=None):
+        """Best candidate neighbors of indexed rows, as a sparse similarity block
+
+        Every row is scored against the members of the lists probed by any
+        row of the block, so blocks of rows from the same lists (see
+        ``neighbor_blocks``) share most of their work. The ``n_candidates``
+        best per row are kept; if the original sparse ``vectors`` are given
+        (with unit-length rows) they are re-scored with their exact cosine
+        similarity.
+
+        Returns a ``(len(row_ids), n_indexed)`` CSR block in the format
+        ``TopKNeighbors.from_blocks`` expects.
+        """
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+        queries = self.embeddings[row_ids]
+        centroid_scores = queries @ self.centroids.T
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+
+        members = np.concatenate(
+            [
+                self.list_items[self.list_offsets[l] : self.list_offsets[l + 1]]
+                for l in np.unique(probes)
+            ]
+        )
+        scores = queries @ self.embeddings[members].T
+
+        n_candidates = min(n_candidates, len(members))
+        top = np.argpartition(-scores, n_candidates - 1, axis=1)[:, :n_candidates]
+        rows = np.repeat(np.arange(len(row_ids)), n_candidates)
+        cols = members[top.ravel()]
+        if vectors is None:
+            data = np.take_along_axis(scores, top, axis=1).ravel()
+        else:
+            data = np.asarray(
+                vectors[np.asarray(row_ids)[rows]].multiply(vectors[cols]).sum(axis=1),
+                dtype=np.float32,
+            ).ravel()
+
+        return sp.csr_matrix(
+            (data, (rows, cols)), shape=(len(row_ids), len(self.embeddings))
+        )
+
+    @staticmethod
+    def _inverse_norms(vectors):
+        norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+        return np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+
+    def neighbor_blocks(
+        self, n_probe=None, block_size=256, vectors=None, pool=None, **kwargs
+    ):
+        """Candidate blocks for every indexed row
+
+        Rows are taken list by list so each block probes few distinct lists.
+        Blocks are scored ``n_jobs`` at a time on a thread pool (the heavy
+        lifting is BLAS, which releases the GIL) and yielded as
+        ``(block, row_ids)`` pairs.
+        """
+        if vectors is not None:
+            vectors = sp.csr_matrix(vectors, dtype=np.float32)
+            vectors = sp.diags(self._inverse_norms(vectors)) @ vectors
+        row_blocks = [
+            self.list_items[start : min(start + block_size, end)]
+            for begin, end in zip(self.list_offsets[:-1], self.list_offsets[1:])
+            for start in range(begin, end, block_size)
+        ]
+
+        def score(row_ids):
+            return self.candidates(row_ids, n_probe, vectors=vectors, **kwargs)
+
+        with thread_pool(self.n_jobs, pool) as pool:
+            for start in range(0, len(row_blocks), self.n_jobs):
+                batch = row_blocks[start : start + self.n_jobs]
+                yield from zip(pool.map(score, batch), batch)
+
+    @property
+    def nbytes(self):
+        return (
+            self.components.nbytes
+            + self.embeddings.nbytes
+            + self.centroids.nbytes
+            + self.list_offsets.nbytes
+            + self.list_items.nbytes
+        )
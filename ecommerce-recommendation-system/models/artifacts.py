@@ -0,0 +1,266 @@
+import contextlib
+import errno
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+import scipy.sparse as sp
+from models.als import ImplicitALS
+from models.ann import IVFIndex
+from models.catalog import ProductCatalog
+from models.history import UserHistoryIndex
+from models.neighbors import TopKNeighbors
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process build lock
+    fcntl = None
+
+# Bump whenever the layout of the artifact directory changes
+ARTIFACT_VERSION = 6
+
+MANIFEST = "manifest.json"
+
+ANN_ARRAYS = ["components", "embeddings", "centroids", "list_offsets", "list_items"]
+
+# Engine settings that change what is built; artifacts built with other
+# values are stale
+MODEL_SETTINGS = [
+    "n_user_neighbors",
+    "n_content_neighbors",
+    "n_item_neighbors",
+    "n_factors",
+    "content_index",
+    "n_probe",
+]
+
+
+def data_fingerprint(data_path, sample_bytes=1 << 20):
+    """Cheap fingerprint of a data file: size, mtime and head/tail digests"""
+    stat = os.stat(data_path)
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(data_path, "rb") as f:
+        digest.update(f.read(sample_bytes))
+        if stat.st_size > sample_bytes:
+            f.seek(max(stat.st_size - sample_bytes, sample_bytes))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def read_manifest(path):
+    """Return the manifest of an artifact directory, or None if there is none"""
+    try:
+        with open(os.path.join(path, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def artifacts_fresh(path, data_path, settings=None):
+    """Whether the artifacts at ``path`` were built from the current data file
+
+    ``settings`` are engine constructor arguments; if one of the
+    ``MODEL_SETTINGS`` differs from what the artifacts were built with, they
+    are stale too. Other arguments are ignored.
+    """
+    manifest = read_manifest(path)
+    built_with = (manifest or {}).get("settings", {})
+    return (
+        manifest is not None
+        and manifest.get("version") == ARTIFACT_VERSION
+        and os.path.exists(data_path)
+        and manifest.get("fingerprint") == data_fingerprint(data_path)
+        and all(
+            built_with.get(name) == value
+            for name, value in (settings or {}).items()
+            if name in MODEL_SETTINGS
+        )
+    )
+
+
+@contextlib.contextmanager
+def build_lock(path):
+    """Hold an exclusive lock on building the artifacts at ``path``
+
+    Processes sharing an artifact directory (e.g. pre-fork workers) take
+    it around a build, so only one of them builds while the others wait
+    and then load what it saved.
+    """
+    if fcntl is None:
+        yield
+        return
+    path = os.path.normpath(path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(f"{path}.lock", "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def replace_directory(staging, path):
+    """Rename the directory ``staging`` to ``path``, replacing what is there
+
+    Processes that memory-mapped files from the old directory keep reading
+    them: the files are unlinked, never truncated.
+    """
+    path = os.path.normpath(path)
+    # Another writer may put its own directory at ``path`` between the two
+    # renames; move that aside too
+    previous = f"{path}.old-{os.getpid()}"
+    while True:
+        if os.path.exists(path):
+            shutil.rmtree(previous, ignore_errors=True)
+            os.rename(path, previous)
+        try:
+            os.rename(staging, path)
+            break
+        except OSError as e:
+            if e.errno not in (errno.ENOTEMPTY, errno.EEXIST):
+                raise
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def _save_sparse(arrays, name, matrix):
+    arrays[f"{name}.data"] = matrix.data
+    arrays[f"{name}.indices"] = matrix.indices
+    arrays[f"{name}.indptr"] = matrix.indptr
+
+
+def _load_sparse(path, name, shape, fmt):
+    parts = [
+        np.load(os.path.join(path, f"{name}.{part}.npy"), mmap_mode="r")
+        for part in ("data", "indices", "indptr")
+    ]
+    matrix_class = sp.csr_matrix if fmt == "csr" else sp.csc_matrix
+    return matrix_class(tuple(parts), shape=shape, copy=False)
+
+
+def save_artifacts(engine, path):
+    """Write a built engine and its data processor as ``.npy`` files
+
+    The directory is written next to ``path`` first and then renamed into
+    place, so readers never see a half-written model.
+    """
+    dp = engine.dp
+    arrays = {
+        "user_neighbors.indices": engine.user_neighbors.indices,
+        "user_neighbors.scores": engine.user_neighbors.scores,
+        "content_neighbors.indices": engine.content_neighbors.indices,
+        "content_neighbors.scores": engine.content_neighbors.scores,
+        "item_neighbors.indices": engine.item_neighbors.indices,
+        "item_neighbors.scores": engine.item_neighbors.scores,
+        "popular_products": engine.popular_products,
+        "history.offsets": dp.user_history.offsets,
+        "history.items": dp.user_history.items,
+        "history.ratings": dp.user_history.ratings,
+    }
+    _save_sparse(arrays, "user_item", dp.user_item_matrix)
+    _save_sparse(arrays, "user_item_csc", dp.user_item_matrix_csc)
+    _save_sparse(arrays, "confidence", dp.confidence_matrix)
+    if engine.als is not None:
+        arrays["als.user_factors"] = engine.als.user_factors
+        arrays["als.item_factors"] = engine.als.item_factors
+    if engine.content_ann is not None:
+        for name in ANN_ARRAYS:
+            arrays[f"content_ann.{name}"] = getattr(engine.content_ann, name)
+    _save_sparse(arrays, "tfidf", engine.tfidf_matrix.tocsr())
+
+    # Text columns become fixed-width unicode so they can be memory-mapped
+    for column, values in dp.catalog.columns.items():
+        if values.dtype == object:
+            values = values.astype(str)
+        arrays[f"catalog.{column}"] = values
+
+    path = os.path.normpath(path)
+    staging = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, f"{name}.npy"), np.asarray(array))
+    dp.save_encoders(os.path.join(staging, "encoders.pkl"))
+
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump(
+            {
+                "version": ARTIFACT_VERSION,
+                "fingerprint": data_fingerprint(dp.data_path),
+                "settings": {name: getattr(engine, name) for name in MODEL_SETTINGS},
+                "created": time.time(),
+                "user_item_shape": list(dp.user_item_matrix.shape),
+                "tfidf_shape": list(engine.tfidf_matrix.shape),
+                "catalog_columns": list(dp.catalog.columns),
+            },
+            f,
+        )
+
+    replace_directory(staging, path)
+
+
+def load_artifacts(path, engine):
+    """Populate ``engine`` and its data processor from ``save_artifacts`` output
+
+    Arrays are opened with ``mmap_mode="r"``: pages are read on first use and
+    shared between processes that load the same directory.
+    """
+    manifest = read_manifest(path)
+    if manifest is None or manifest.get("version") != ARTIFACT_VERSION:
+        raise ValueError(f"No compatible model artifacts in {path}")
+
+    def load(name):
+        return np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+
+    dp = engine.dp
+    dp.load_encoders(os.path.join(path, "encoders.pkl"))
+    for name, value in manifest["settings"].items():
+        setattr(engine, name, value)
+
+    user_item_shape = tuple(manifest["user_item_shape"])
+    dp.user_item_matrix = _load_sparse(path, "user_item", user_item_shape, "csr")
+    dp.user_item_matrix_csc = _load_sparse(
+        path, "user_item_csc", user_item_shape, "csc"
+    )
+    dp.confidence_matrix = _load_sparse(path, "confidence", user_item_shape, "csr")
+    dp.catalog = ProductCatalog(
+        {column: load(f"catalog.{column}") for column in manifest["catalog_columns"]}
+    )
+    dp.user_history = UserHistoryIndex(
+        dp.user_index,
+        load("history.offsets"),
+        load("history.items"),
+        load("history.ratings"),
+    )
+
+    engine.user_item_matrix = dp.user_item_matrix
+    engine.user_item_matrix_csc = dp.user_item_matrix_csc
+    engine.tfidf_matrix = _load_sparse(
+        path, "tfidf", tuple(manifest["tfidf_shape"]), "csr"
+    )
+    engine.user_neighbors = TopKNeighbors.from_arrays(
+        load("user_neighbors.indices"), load("user_neighbors.scores")
+    )
+    engine.content_neighbors = TopKNeighbors.from_arrays(
+        load("content_neighbors.indices"), load("content_neighbors.scores")
+    )
+    engine.item_neighbors = TopKNeighbors.from_arrays(
+        load("item_neighbors.indices"), load("item_neighbors.scores")
+    )
+    engine.item_similarity = engine.item_neighbors.to_csr()
+    engine.popular_products = load("popular_products")
+    if os.path.exists(os.path.join(path, "als.user_factors.npy")):
+        user_factors = load("als.user_factors")
+        engine.als = ImplicitALS(factors=user_factors.shape[1])
+        engine.als.user_factors = user_factors
+        engine.als.item_factors = load("als.item_factors")
+    if os.path.exists(os.path.join(path, "content_ann.centroids.npy")):
+        engine.content_ann = IVFIndex.from_arrays(
+            *(load(f"content_ann.{name}") for name in ANN_ARRAYS)
+        )
+    engine.user_map = dp.user_map
+    engine.product_map = dp.product_map
+    engine.product_ids = dp.product_map.ids
+    return engine
@@ -0,0 +1,77 @@
+import numpy as np
+
+
+class ProductCatalog:
+    """Columnar product lookup table keyed by product id
+
+    Built once from the transactions frame so that routes can hydrate
+    recommended products with a dict lookup and an array gather instead of
+    scanning the whole frame per product.
+    """
+
+    COLUMNS = [
+        "product_id",
+        "product_name",
+        "category",
+        "brand",
+        "description",
+        "price",
+        "discount",
+        "in_stock",
+        "rating",
+    ]
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.index = {
+            product_id: row for row, product_id in enumerate(columns["product_id"])
+        }
+
+    @classmethod
+    def from_dataframe(cls, df, sort=True):
+        """Build the catalog from a (denormalized) transactions frame
+
+        Products are ordered by id, or by first appearance if ``sort`` is off.
+        """
+        products = df.drop_duplicates("product_id").set_index("product_id")
+        if sort:
+            products = products.sort_index()
+        if "rating" in df.columns:
+            # Ratings are read as float32; round in float64 so 3.6 stays 3.6
+            # rather than 3.5999999046325684 once converted to Python floats
+            ratings = df.groupby("product_id")["rating"].mean().astype(np.float64)
+            products["rating"] = ratings.round(1)
+
+        columns = {"product_id": products.index.to_numpy()}
+        for column in cls.COLUMNS[1:]:
+            if column in products.columns:
+                columns[column] = products[column].to_numpy()
+        return cls(columns)
+
+    def append(self, other):
+        """Add the products of another catalog after the existing ones"""
+        start = len(self)
+        for column, values in self.columns.items():
+            self.columns[column] = np.concatenate([values, other.columns[column]])
+        for offset, product_id in enumerate(other.columns["product_id"]):
+            self.index[product_id] = start + offset
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, product_id):
+        return product_id in self.index
+
+    def get(self, product_id, fields=None):
+        """Return one product as a dict, or None if it is unknown"""
+        products = self.get_many([product_id], fields)
+        return products[0] if products else None
+
+    def get_many(self, product_ids, fields=None):
+        """Return products as dicts in the order given, skipping unknown ids"""
+        rows = [self.index.get(product_id) for product_id in product_ids]
+        rows = np.array([row for row in rows if row is not None], dtype=np.intp)
+
+        fields = [field for field in fields or self.COLUMNS if field in self.columns]
+        values = [self.columns[field][rows].tolist() for field in fields]
+        return [dict(zip(fields, record)) for record in zip(*values)]
@@ -1,115 +1,515 @@
+import json
+import logging
 import pickle
 import os
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import LabelEncoder, MinMaxScaler
+import scipy.sparse as sp
+from sklearn.preprocessing import MinMaxScaler
 from sklearn.feature_extraction.text import TfidfVectorizer
+from models.artifacts import data_fingerprint
+from models.catalog import ProductCatalog
+from models.history import UserHistoryIndex
+from models.id_map import IdMap
+from models import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class DataProcessor:
-    def __init__(self, data_path):
+    # Compact dtypes for the source columns; anything else is inferred
+    DTYPES = {
+        "transaction_id": "int64",
+        "user_id": "int64",
+        "product_id": "int64",
+        "rating": "float32",
+        "rating_x": "float32",
+        "rating_y": "float32",
+        "purchase_count": "int16",
+        "discount": "int16",
+        "age": "int16",
+        "in_stock": "bool",
+        "is_festive_season": "bool",
+        "payment_method": "category",
+        "delivery_status": "category",
+        "category": "category",
+        "brand": "category",
+        "gender": "category",
+        "location": "category",
+        "state": "category",
+    }
+
+    # Columns needed to build the models and serve the app
+    MODEL_COLUMNS = [
+        "user_id",
+        "product_id",
+        "rating",
+        "timestamp",
+        "purchase_count",
+        "product_name",
+        "category",
+        "brand",
+        "description",
+        "price",
+        "discount",
+        "in_stock",
+        "name",
+        "age",
+        "gender",
+        "location",
+        "state",
+    ]
+
+    def __init__(self, data_path, cache_path=None):
         self.data_path = data_path
-        self.df = None
-        self.user_encoder = LabelEncoder()
-        self.product_encoder = LabelEncoder()
+        self.cache_path = cache_path or os.path.splitext(data_path)[0] + ".parquet"
+        self._df = None
+        # Bumped whenever the transactions change, so derived views can
+        # tell when they are stale
+        self.version = 0
+        self.user_map = IdMap()
+        self.product_map = IdMap()
         self.tfidf_vectorizer = TfidfVectorizer(max_features=1000, stop_words="english")
         self.scaler = MinMaxScaler()
+        self.user_item_matrix = None
+        self.user_item_matrix_csc = None
+        self.confidence_matrix = None
+        self.catalog = None
+        self.user_history = None
+
+    @property
+    def df(self):
+        """Transactions frame, read from ``data_path`` on first access
+
+        Warm-started processors only touch the raw data when a caller
+        actually needs it (e.g. the dashboard).
+        """
+        if self._df is None and os.path.exists(self.data_path):
+            self.load_data()
+        return self._df
+
+    @df.setter
+    def df(self, value):
+        self._df = value
+        self.version += 1
+
+    def load_data(self, columns=None):
+        """Load and preprocess the data
+
+        Reads the columnar cache when it is fresh; otherwise parses the CSV
+        with compact dtypes and refreshes the cache. ``columns`` limits what
+        is read (unknown names are ignored).
+        """
+        with metrics.build_stage("load_data"):
+            df = self._read_cache(columns)
+            if df is None:
+                df = self._prepare_frame(self._read_csv())
+                self._write_cache(df)
+                if columns is not None:
+                    df = df[[column for column in columns if column in df.columns]]
+        self._df = df
+        self.version += 1
+
+        logger.info("Data loaded transactions=%d columns=%d", len(df), len(df.columns))
+        if "category" in df.columns:
+            logger.debug("categories=%s", df["category"].unique().tolist())
+
+        return self.df
+
+    def load_partition(self, keep, columns=None, chunk_size=1_000_000):
+        """Load only the transactions of the users selected by ``keep``
+
+        ``keep`` maps an array of user ids to a boolean mask. The data is
+        read a chunk at a time, so memory holds one chunk plus the rows
+        kept; shard workers (models/sharding.py) load their users this way.
+        """
+        with metrics.build_stage("load_data"):
+            df = pd.concat(
+                [
+                    chunk[keep(chunk["user_id"].to_numpy())]
+                    for chunk in self._read_chunks(columns, chunk_size)
+                ],
+                ignore_index=True,
+            )
+            # Chunks may carry different category sets, which concat widens
+            # to object columns
+            for column, dtype in self.DTYPES.items():
+                if dtype == "category" and column in df.columns:
+                    df[column] = df[column].astype("category")
+        self._df = df
+        self.version += 1
+
+        logger.info("Data partition loaded transactions=%d", len(df))
+        return self.df
 
-    def load_data(self):
-        """Load and preprocess the data"""
-        self.df = pd.read_csv(self.data_path)
+    def _read_chunks(self, columns, chunk_size):
+        """Transactions in chunks, from the columnar cache if it is fresh"""
+        meta = self._cache_meta()
+        if meta is not None:
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                meta = None
+
+        if meta is not None:
+            if columns is not None:
+                columns = [column for column in columns if column in meta["columns"]]
+            parquet = pq.ParquetFile(self.cache_path)
+            for batch in parquet.iter_batches(chunk_size, columns=columns):
+                yield batch.to_pandas()
+            return
+
+        for chunk in self._read_csv(chunksize=chunk_size):
+            chunk = self._prepare_frame(chunk)
+            if columns is not None:
+                chunk = chunk[[column for column in columns if column in chunk.columns]]
+            yield chunk
+
+    def _read_csv(self, chunksize=None):
+        """Parse the source CSV with explicit dtypes
+
+        With ``chunksize``, returns an iterator of frames instead.
+        """
+        header = pd.read_csv(self.data_path, nrows=0).columns
+        return pd.read_csv(
+            self.data_path,
+            dtype={
+                column: dtype
+                for column, dtype in self.DTYPES.items()
+                if column in header
+            },
+            parse_dates=["timestamp"] if "timestamp" in header else False,
+            chunksize=chunksize,
+        )
+
+    def _cache_meta(self):
+        """Metadata of the columnar cache, or None if it is missing or stale"""
+        try:
+            with open(self.cache_path + ".json") as f:
+                meta = json.load(f)
+            fresh = meta["fingerprint"] == data_fingerprint(self.data_path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        return meta if fresh and "columns" in meta else None
+
+    def _read_cache(self, columns=None):
+        """Read the columnar cache, or return None if it is missing or stale"""
+        meta = self._cache_meta()
+        if meta is None:
+            return None
+        if columns is not None:
+            columns = [column for column in columns if column in meta["columns"]]
+        try:
+            return pd.read_parquet(self.cache_path, columns=columns)
+        except (OSError, ValueError, ImportError):
+            return None
+
+    def _write_cache(self, df):
+        """Write ``df`` to the columnar cache, tagged with the source fingerprint"""
+        staging = f"{self.cache_path}.tmp-{os.getpid()}"
+        try:
+            df.to_parquet(staging, index=False)
+        except ImportError:
+            logger.warning("pyarrow is not installed, skipping the columnar data cache")
+            return
+        except (OSError, ValueError) as e:
+            logger.error("Error writing columnar data cache: %s", e)
+            return
+
+        os.replace(staging, self.cache_path)
+        with open(self.cache_path + ".json", "w") as f:
+            json.dump(
+                {
+                    "fingerprint": data_fingerprint(self.data_path),
+                    "columns": df.columns.tolist(),
+                },
+                f,
+            )
 
+    @staticmethod
+    def _prepare_frame(df):
+        """Normalize raw transaction columns"""
         # Convert timestamp if it exists
-        if "timestamp" in self.df.columns:
-            self.df["timestamp"] = pd.to_datetime(self.df["timestamp"])
+        if "timestamp" in df.columns:
+            df["timestamp"] = pd.to_datetime(df["timestamp"])
+
+        # The generated data merges transaction and product ratings into
+        # rating_x / rating_y; the transaction rating is the one we model
+        if "rating" not in df.columns and "rating_x" in df.columns:
+            df = df.rename(columns={"rating_x": "rating"})
 
         # Ensure rating column exists
-        if "rating" not in self.df.columns:
+        if "rating" not in df.columns:
             # Create synthetic ratings if they don't exist
-            self.df["rating"] = np.random.randint(1, 6, len(self.df))
-
-        print(f"Indian E-commerce Data loaded successfully!")
-        print(f"Dataset Shape: {self.df.shape}")
-        print(f"Total Users: {self.df['user_id'].nunique():,}")
-        print(f"Total Products: {self.df['product_id'].nunique():,}")
-        print(f"Total Transactions: {len(self.df):,}")
-        print(f"Categories: {self.df['category'].unique().tolist()}")
+            df["rating"] = np.random.randint(1, 6, len(df))
 
-        return self.df
+        return df
 
     def preprocess_data(self):
         """Preprocess the data for recommendation systems"""
-        if self.df is None:
+        if self._df is None:
             self.load_data()
 
         # Encode user and product IDs
-        self.df["user_id_encoded"] = self.user_encoder.fit_transform(self.df["user_id"])
-        self.df["product_id_encoded"] = self.product_encoder.fit_transform(
+        self.user_map, self.df["user_id_encoded"] = IdMap.fit(self.df["user_id"])
+        self.product_map, self.df["product_id_encoded"] = IdMap.fit(
             self.df["product_id"]
         )
 
-        print("Creating user-item matrix...")
+        # Sparse user-item matrix built straight from the encoded codes, so
+        # memory scales with the number of interactions rather than
+        # users x products
+        self.user_item_matrix = self.build_interaction_matrix(
+            self.df["user_id_encoded"].to_numpy(),
+            self.df["product_id_encoded"].to_numpy(),
+            self.df["rating"].to_numpy(dtype=np.float32),
+            shape=(len(self.user_map), len(self.product_map)),
+        )
+        self.user_item_matrix_csc = self.user_item_matrix.tocsc()
+        self.confidence_matrix = self.build_interaction_matrix(
+            self.df["user_id_encoded"].to_numpy(),
+            self.df["product_id_encoded"].to_numpy(),
+            self.interaction_weights(self.df),
+            shape=self.user_item_matrix.shape,
+            mean=False,
+        )
+        logger.info(
+            "User-item matrix users=%d products=%d interactions=%d",
+            *self.user_item_matrix.shape,
+            self.user_item_matrix.nnz,
+        )
 
-        # Create user-item matrix with error handling
-        try:
-            self.user_item_matrix = self.df.pivot_table(
-                index="user_id_encoded",
-                columns="product_id_encoded",
-                values="rating",
-                fill_value=0,
-            )
-            print(f"User-item matrix created. Shape: {self.user_item_matrix.shape}")
-        except Exception as e:
-            print(f"Error creating pivot table: {e}")
-            # Create a simple user-item matrix manually
-            unique_users = self.df["user_id_encoded"].unique()
-            unique_products = self.df["product_id_encoded"].unique()
-
-            self.user_item_matrix = pd.DataFrame(
-                0, index=unique_users, columns=unique_products
-            )
+        # Product lookup table for hydrating recommendations
+        self.catalog = ProductCatalog.from_dataframe(self.df)
 
-            # Fill with actual ratings
-            for _, row in self.df.iterrows():
-                self.user_item_matrix.loc[
-                    row["user_id_encoded"], row["product_id_encoded"]
-                ] = row["rating"]
+        # Timestamp-ordered interaction history per user
+        self.user_history = UserHistoryIndex.from_dataframe(self.df, self.user_index)
 
         return self.df, self.user_item_matrix
 
+    @property
+    def user_index(self):
+        """Dict from original user id to code"""
+        return self.user_map.index
+
+    @property
+    def product_index(self):
+        """Dict from original product id to code"""
+        return self.product_map.index
+
+    def ingest(self, transactions):
+        """Append new transactions without refitting id maps or rebuilding
+
+        ``transactions`` has the same columns as the source data and may
+        reference users and products that have never been seen. The
+        interaction matrix, catalog and user history are updated in place of
+        a full ``preprocess_data`` run.
+
+        Returns the encoded users and products of the new rows and the codes
+        of the products that were added to the catalog.
+        """
+        new = self._prepare_frame(pd.DataFrame(transactions).copy())
+        if "timestamp" in new.columns:
+            new = new.sort_values("timestamp", kind="stable")
+        new = new.reset_index(drop=True)
+
+        n_products = len(self.product_map)
+        user_codes = self.user_map.append(new["user_id"].tolist())
+        product_codes = self.product_map.append(new["product_id"].tolist())
+        new["user_id_encoded"] = user_codes
+        new["product_id_encoded"] = product_codes
+        ratings = new["rating"].to_numpy(dtype=np.float32)
+
+        # Fold the new ratings into the running (user, product) means, using
+        # the history to know how many ratings each existing mean covers
+        shape = (len(self.user_map), len(self.product_map))
+        keys = user_codes * shape[1] + product_codes
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        users, products = unique_keys // shape[1], unique_keys % shape[1]
+        totals = np.bincount(inverse, weights=ratings)
+        counts = np.bincount(inverse)
+
+        # Only the rows of the users (and, in the CSC copy, the products) of
+        # the batch are rewritten, so an ingest costs O(batch) sorting plus a
+        # copy of the arrays rather than a rebuild of every matrix
+        previous = np.zeros(len(unique_keys))
+        inside = (users < self.user_item_matrix.shape[0]) & (
+            products < self.user_item_matrix.shape[1]
+        )
+        previous[inside] = np.asarray(
+            self.user_item_matrix[users[inside], products[inside]]
+        ).ravel()
+        previous_counts = self.user_history.interaction_counts(users, products)
+        means = (previous * previous_counts + totals) / (previous_counts + counts)
+
+        self.user_item_matrix = self._merge_rows(
+            self.user_item_matrix, users, products, means, shape
+        )
+        self.user_item_matrix_csc = self._merge_rows(
+            self.user_item_matrix_csc.T, products, users, means, shape[::-1]
+        ).T
+        self.confidence_matrix = self._merge_rows(
+            self.confidence_matrix,
+            users,
+            products,
+            np.bincount(inverse, weights=self.interaction_weights(new)),
+            shape,
+            add=True,
+        )
+
+        self.user_history.append(user_codes, product_codes, ratings)
+
+        new_products = new[product_codes >= n_products]
+        self.catalog.append(ProductCatalog.from_dataframe(new_products, sort=False))
+
+        if self._df is not None:
+            self._df = pd.concat([self._df, new], ignore_index=True)
+        self.version += 1
+
+        logger.info(
+            "Ingested transactions=%d new_products=%d",
+            len(new),
+            new_products["product_id"].nunique(),
+        )
+        return user_codes, product_codes, np.arange(n_products, shape[1])
+
+    @staticmethod
+    def _merge_rows(matrix, rows, cols, values, shape, add=False):
+        """CSR ``matrix`` grown to ``shape`` with ``values`` at (rows, cols)
+
+        The values replace the stored entries, or are added to them when
+        ``add`` is True; (row, col) pairs must be unique. Only the rows
+        involved are merged and sorted, the other rows' entries are copied
+        over as they are.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        indptr = np.concatenate(
+            [
+                matrix.indptr,
+                np.full(shape[0] - matrix.shape[0], matrix.indptr[-1]),
+            ]
+        ).astype(np.int64)
+
+        # Gather the stored entries of the rows involved
+        affected = np.unique(rows)
+        starts = indptr[affected]
+        lengths = indptr[affected + 1] - starts
+        before = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - before, lengths) + np.arange(lengths.sum())
+        old_values = matrix.data[positions]
+
+        keys = np.concatenate(
+            [
+                np.repeat(affected, lengths) * shape[1] + matrix.indices[positions],
+                rows * shape[1] + cols,
+            ]
+        )
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        if add:
+            merged = np.bincount(
+                inverse,
+                weights=np.concatenate([old_values, values]),
+                minlength=len(unique_keys),
+            )
+        else:
+            merged = np.zeros(len(unique_keys))
+            merged[inverse[: len(old_values)]] = old_values
+            merged[inverse[len(old_values) :]] = values
+        row_lengths = np.bincount(
+            np.searchsorted(affected, unique_keys // shape[1]),
+            minlength=len(affected),
+        )
+
+        # Drop the old entries and insert the merged ones where each row
+        # starts once the entries before it are gone
+        kept = np.ones(len(matrix.data), dtype=bool)
+        kept[positions] = False
+        at = np.repeat(starts - before, row_lengths)
+        data = np.insert(matrix.data[kept], at, merged.astype(matrix.dtype))
+        indices = np.insert(matrix.indices[kept], at, unique_keys % shape[1])
+
+        counts = np.diff(indptr)
+        counts[affected] = row_lengths
+        indptr = np.zeros(shape[0] + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        merged_matrix = sp.csr_matrix((data, indices, indptr), shape=shape)
+        merged_matrix.has_sorted_indices = True
+        return merged_matrix
+
+    @staticmethod
+    def interaction_weights(df):
+        """Implicit feedback strength of each transaction: rating x quantity"""
+        weights = df["rating"].to_numpy(dtype=np.float32)
+        if "purchase_count" in df.columns:
+            weights = weights * df["purchase_count"].to_numpy(dtype=np.float32)
+        return weights
+
+    @staticmethod
+    def build_interaction_matrix(user_codes, product_codes, values, shape, mean=True):
+        """Build a CSR matrix from (user, product, value) triples
+
+        Repeated (user, product) pairs are averaged, like ``pivot_table``
+        does, or summed when ``mean`` is False.
+        """
+        keys = user_codes.astype(np.int64) * shape[1] + product_codes
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        totals = np.bincount(inverse, weights=values)
+        counts = np.bincount(inverse)
+
+        matrix = sp.csr_matrix(
+            (
+                (totals / counts if mean else totals).astype(np.float32),
+                (unique_keys // shape[1], unique_keys % shape[1]),
+            ),
+            shape=shape,
+        )
+        matrix.sort_indices()
+        return matrix
+
     def get_product_features(self):
         """Extract product features for content-based filtering"""
-        product_features = self.df[
-            [
-                "product_id",
-                "product_name",
-                "category",
-                "brand",
-                "description",
-                "price",
-                "discount",
+        # One row per product, ordered like the product id map so that row
+        # numbers double as encoded product ids
+        product_features = (
+            self.df.drop_duplicates("product_id")[
+                [
+                    "product_id",
+                    "product_name",
+                    "category",
+                    "brand",
+                    "description",
+                    "price",
+                    "discount",
+                ]
             ]
-        ].drop_duplicates()
+            .sort_values("product_id")
+            .reset_index(drop=True)
+        )
 
         # Create TF-IDF features from product description and category
-        product_features["text_features"] = (
-            product_features["product_name"].fillna("")
-            + " "
-            + product_features["category"].fillna("")
-            + " "
-            + product_features["brand"].fillna("")
-            + " "
-            + product_features["description"].fillna("")
-        )
+        product_features["text_features"] = self.product_text(product_features)
 
         tfidf_matrix = self.tfidf_vectorizer.fit_transform(
             product_features["text_features"]
         )
 
-        print(f"Product features extracted. Shape: {tfidf_matrix.shape}")
+        logger.info("Product features products=%d terms=%d", *tfidf_matrix.shape)
 
         return product_features, tfidf_matrix
 
+    @staticmethod
+    def product_text(products):
+        """Text that TF-IDF product features are computed from"""
+        text = products["product_name"].astype(object).fillna("")
+        for column in ["category", "brand", "description"]:
+            text = text + " " + products[column].astype(object).fillna("")
+        return text
+
+    def transform_product_features(self, products):
+        """TF-IDF features for new products, using the fitted vocabulary"""
+        return self.tfidf_vectorizer.transform(self.product_text(products))
+
     def get_user_features(self):
         """Extract user features for collaborative filtering"""
         user_features = (
@@ -177,13 +577,13 @@ class DataProcessor:
         return insights
 
     def save_encoders(self, path):
-        """Save encoders and vectorizers for future use"""
+        """Save id maps and vectorizers for future use"""
         os.makedirs(os.path.dirname(path), exist_ok=True)
         with open(path, "wb") as f:
             pickle.dump(
                 {
-                    "user_encoder": self.user_encoder,
-                    "product_encoder": self.product_encoder,
+                    "user_map": self.user_map,
+                    "product_map": self.product_map,
                     "tfidf_vectorizer": self.tfidf_vectorizer,
                     "scaler": self.scaler,
                 },
@@ -191,11 +591,11 @@ class DataProcessor:
             )
 
     def load_encoders(self, path):
-        """Load saved encoders and vectorizers"""
+        """Load saved id maps and vectorizers"""
         with open(path, "rb") as f:
             encoders = pickle.load(f)
-            self.user_encoder = encoders["user_encoder"]
-            self.product_encoder = encoders["product_encoder"]
+            self.user_map = encoders["user_map"]
+            self.product_map = encoders["product_map"]
             self.tfidf_vectorizer = encoders["tfidf_vectorizer"]
             self.scaler = encoders["scaler"]
 
@@ -230,8 +630,8 @@ class DataProcessor:
                 self.df["location"].value_counts().head(5).to_dict()
             )
 
-        except Exception as e:
-            print(f"Error generating insights: {e}")
+        except Exception:
+            logger.exception("Error generating insights")
             # Return default insights
             insights = {
                 "avg_price": 0,
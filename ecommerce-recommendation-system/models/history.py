@@ -0,0 +1,141 @@
+import numpy as np
+
+
+class UserHistoryIndex:
+    """Per-user interaction history stored as CSR-style offsets
+
+    Interactions are sorted by (user, timestamp) once, so each user's history
+    is the contiguous slice ``offsets[u]:offsets[u + 1]`` and lookups cost
+    O(history length) instead of a scan over the whole frame.
+    """
+
+    def __init__(self, user_index, offsets, items, ratings):
+        self.user_index = user_index
+        self.offsets = offsets
+        self.items = items
+        self.ratings = ratings
+
+    @classmethod
+    def from_dataframe(cls, df, user_index):
+        """Build the index from a frame with encoded user and product columns
+
+        ``user_index`` maps original user ids to their codes.
+        """
+        user_codes = df["user_id_encoded"].to_numpy()
+        if "timestamp" in df.columns:
+            order = np.lexsort((df["timestamp"].to_numpy(), user_codes))
+        else:
+            order = np.argsort(user_codes, kind="stable")
+
+        counts = np.bincount(user_codes, minlength=len(user_index))
+        offsets = np.zeros(len(user_index) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        return cls(
+            user_index,
+            offsets,
+            df["product_id_encoded"].to_numpy()[order].astype(np.int32),
+            df["rating"].to_numpy()[order].astype(np.float32),
+        )
+
+    def append(self, user_codes, items, ratings):
+        """Add interactions that are newer than everything indexed so far
+
+        New users may appear; they must already be in ``user_index``.
+        """
+        user_codes = np.asarray(user_codes, dtype=np.int64)
+        offsets = np.concatenate(
+            [
+                self.offsets,
+                np.full(len(self.user_index) + 1 - len(self.offsets), self.offsets[-1]),
+            ]
+        ).astype(np.int64)
+
+        # Each new interaction goes at the end of its user's slice; only the
+        # batch is sorted, the existing arrays are copied around it
+        order = np.argsort(user_codes, kind="stable")
+        at = offsets[user_codes[order] + 1]
+        self.items = np.insert(self.items, at, np.asarray(items)[order]).astype(
+            np.int32, copy=False
+        )
+        self.ratings = np.insert(self.ratings, at, np.asarray(ratings)[order]).astype(
+            np.float32, copy=False
+        )
+
+        counts = np.bincount(user_codes, minlength=len(offsets) - 1)
+        offsets[1:] += np.cumsum(counts)
+        self.offsets = offsets
+
+    def interaction_counts(self, user_codes, product_codes):
+        """Number of indexed interactions for each (user, product) pair"""
+        user_codes = np.asarray(user_codes, dtype=np.int64)
+        product_codes = np.asarray(product_codes, dtype=np.int64)
+        n_users = len(self.offsets) - 1
+        users = np.unique(user_codes[user_codes < n_users])
+
+        # Gather the history slices of the users involved
+        starts = self.offsets[users]
+        lengths = self.offsets[users + 1] - starts
+        positions = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions += np.arange(lengths.sum())
+
+        width = int(max(product_codes.max(initial=0), self.items.max(initial=0))) + 1
+        history_keys = np.sort(
+            np.repeat(users, lengths) * width + self.items[positions]
+        )
+        keys = user_codes * width + product_codes
+        return np.searchsorted(history_keys, keys, side="right") - np.searchsorted(
+            history_keys, keys, side="left"
+        )
+
+    def most_active_users(self, n):
+        """Encoded users with the most interactions, most active first"""
+        counts = np.diff(self.offsets)
+        n = min(n, len(counts))
+        top = np.argpartition(-counts, n - 1)[:n] if n > 0 else counts[:0]
+        return top[np.argsort(-counts[top], kind="stable")]
+
+    def __contains__(self, user_id):
+        return user_id in self.user_index
+
+    def _slice(self, user_id):
+        code = self.user_index.get(user_id)
+        if code is None:
+            return slice(0, 0)
+        return slice(self.offsets[code], self.offsets[code + 1])
+
+    def latest_items(self, user_codes):
+        """Encoded latest product of each encoded user, -1 for no history"""
+        user_codes = np.asarray(user_codes)
+        known = user_codes >= 0
+        starts = self.offsets[np.where(known, user_codes, 0)]
+        ends = self.offsets[np.where(known, user_codes + 1, 0)]
+        has_history = known & (ends > starts)
+        return np.where(has_history, self.items[np.maximum(ends - 1, 0)], -1)
+
+    def recent_items(self, user_codes, n):
+        """Encoded latest ``n`` products of each encoded user, newest first
+
+        Returns a ``(len(user_codes), n)`` array padded with -1.
+        """
+        user_codes = np.asarray(user_codes)
+        known = user_codes >= 0
+        starts = self.offsets[np.where(known, user_codes, 0)]
+        ends = self.offsets[np.where(known, user_codes + 1, 0)]
+        positions = ends[:, None] - 1 - np.arange(n)
+        valid = known[:, None] & (positions >= starts[:, None])
+        return np.where(valid, self.items[np.where(valid, positions, 0)], -1)
+
+    def last_interactions(self, user_id, n):
+        """Encoded products and ratings of the ``n`` latest interactions, newest first"""
+        history = self._slice(user_id)
+        return self.items[history][::-1][:n], self.ratings[history][::-1][:n]
+
+    def last_items(self, user_id, n):
+        """Encoded products of the user's ``n`` latest interactions, newest first"""
+        history = self.items[self._slice(user_id)]
+        return history[::-1][:n]
+
+    def seen_items(self, user_id):
+        """Sorted unique encoded products the user has interacted with"""
+        return np.unique(self.items[self._slice(user_id)])
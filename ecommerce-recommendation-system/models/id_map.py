@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+
+
+class IdMap:
+    """Two-way mapping between external ids and dense integer codes
+
+    Codes index ``ids`` directly; ``index`` is a dict for single lookups
+    and a hashed ``pd.Index`` serves batch transforms. Unknown ids map to
+    ``UNKNOWN`` instead of raising, and new ids can be appended without
+    changing existing codes.
+    """
+
+    UNKNOWN = -1
+
+    def __init__(self, ids=None):
+        self.ids = np.empty(0, dtype=np.int64) if ids is None else np.asarray(ids)
+        self.index = {
+            external_id: code for code, external_id in enumerate(self.ids.tolist())
+        }
+        self._lookup = None
+
+    @classmethod
+    def fit(cls, values):
+        """Map the distinct ``values``, in sorted order, and return (map, codes)"""
+        codes, ids = pd.factorize(np.asarray(values), sort=True)
+        return cls(ids), codes.astype(np.int64)
+
+    def code(self, external_id):
+        """Code of one id, or ``UNKNOWN``"""
+        return self.index.get(external_id, self.UNKNOWN)
+
+    def transform(self, values):
+        """Codes of many ids, with ``UNKNOWN`` for ids that are not mapped"""
+        if self._lookup is None:
+            self._lookup = pd.Index(self.ids)
+        values = np.asarray(values)
+        if len(values) == 0:
+            return np.empty(0, dtype=np.int64)
+        return self._lookup.get_indexer(values).astype(np.int64)
+
+    def inverse(self, codes):
+        """Ids of ``codes``"""
+        return self.ids[codes]
+
+    def append(self, values):
+        """Codes of ``values``, giving unseen ids the next free codes
+
+        New ids are added in first-seen order, so existing codes never change.
+        """
+        values = list(values)
+        new_ids = [value for value in dict.fromkeys(values) if value not in self.index]
+        if new_ids:
+            for code, new_id in enumerate(new_ids, start=len(self.ids)):
+                self.index[new_id] = code
+            self.ids = np.concatenate(
+                [self.ids, np.asarray(new_ids, dtype=self.ids.dtype)]
+            )
+            self._lookup = None
+        return np.fromiter(
+            (self.index[value] for value in values), dtype=np.int64, count=len(values)
+        )
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, external_id):
+        return external_id in self.index
+
+    def __getstate__(self):
+        # The lookup tables are rebuilt from the ids on load
+        return {"ids": self.ids}
+
+    def __setstate__(self, state):
+        self.__init__(state["ids"])
@@ -0,0 +1,242 @@
+import bisect
+import contextlib
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+BUILD_BUCKETS = (0.01, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        for value in labels.values()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key, **extra):
+        return {**dict(zip(self.labelnames, key)), **extra}
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self._labels(key))} {value}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    """Cumulative bucket counts, sum and count of observed values"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def sums(self):
+        """Sum of the observed values per label values tuple"""
+        with self._lock:
+            return {key: state[1] for key, state in self._values.items()}
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        """Observe the wall time of a block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, key, value):
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self._labels(key, le=repr(float(bound))))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self._labels(key, le="+Inf"))
+        lines.append(f"{self.name}_bucket{labels} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(self._labels(key))} {total}")
+        lines.append(f"{self.name}_count{_format_labels(self._labels(key))} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics rendered together in the Prometheus text format"""
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, labelnames=()):
+        return self._register(Gauge(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def process_rss_bytes():
+    """Current resident set size, or 0 where it cannot be read"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+REGISTRY = MetricsRegistry()
+
+BUILD_STAGE_SECONDS = REGISTRY.histogram(
+    "recommender_build_stage_seconds",
+    "Wall time of model build stages",
+    ["stage"],
+    BUILD_BUCKETS,
+)
+BUILD_STAGE_RSS = REGISTRY.gauge(
+    "recommender_build_stage_rss_bytes",
+    "Resident memory at the end of the last run of each build stage",
+    ["stage"],
+)
+BUILD_STAGE_ERRORS = REGISTRY.counter(
+    "recommender_build_stage_errors_total",
+    "Build stages that failed and fell back",
+    ["stage"],
+)
+RECOMMEND_SECONDS = REGISTRY.histogram(
+    "recommender_recommend_seconds",
+    "Latency of get_user_recommendations, including cache hits",
+    ["method"],
+)
+RECOMMEND_ERRORS = REGISTRY.counter(
+    "recommender_recommend_errors_total",
+    "Recommendation calls that failed and returned a fallback",
+    ["method"],
+)
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Latency of HTTP requests by route",
+    ["route", "status"],
+)
+MODEL_BYTES = REGISTRY.gauge(
+    "recommender_model_bytes", "Memory held by each model component", ["component"]
+)
+MODEL_ENTITIES = REGISTRY.gauge(
+    "recommender_model_entities", "Users and products known to the model", ["kind"]
+)
+MODEL_VERSION = REGISTRY.gauge("recommender_model_version", "Current model version")
+MODEL_REBUILDS = REGISTRY.counter(
+    "recommender_model_rebuilds_total", "Background model rebuilds", ["result"]
+)
+CACHE_EVENTS = REGISTRY.gauge(
+    "recommender_cache_events", "Recommendation cache counters", ["event"]
+)
+CACHE_BYTES = REGISTRY.gauge(
+    "recommender_cache_bytes", "Estimated memory held by the recommendation cache"
+)
+PROCESS_RSS = REGISTRY.gauge(
+    "process_resident_memory_bytes", "Resident memory of this process"
+)
+
+
+@contextlib.contextmanager
+def build_stage(stage):
+    """Time a build stage, record memory after it and log both"""
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    rss = process_rss_bytes()
+    BUILD_STAGE_SECONDS.observe(seconds, stage=stage)
+    BUILD_STAGE_RSS.set(rss, stage=stage)
+    logger.info("build stage=%s seconds=%.3f rss_mb=%.1f", stage, seconds, rss / 2**20)
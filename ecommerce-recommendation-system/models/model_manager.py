@@ -0,0 +1,188 @@
+import gc
+import logging
+import threading
+import time
+import weakref
+from models import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ModelSnapshot:
+    """A data processor, the engine built from it and their derived views
+
+    Snapshots are never modified once published: a refresh builds a new
+    one. Request handlers read ``ModelManager.current`` once and use that
+    snapshot for the whole request.
+    """
+
+    __slots__ = ("dp", "engine", "aggregates", "source", "created", "__weakref__")
+
+    def __init__(self, dp, engine, aggregates, source=None):
+        self.dp = dp
+        self.engine = engine
+        self.aggregates = aggregates
+        # Identifies the saved artifacts the snapshot was loaded from, if any
+        self.source = source
+        self.created = time.time()
+
+
+class ModelManager:
+    """Rebuilds model snapshots in the background and swaps them in
+
+    ``builder`` is a callable returning a new ``ModelSnapshot``. Only one
+    build runs at a time, and a build does not start until the snapshot
+    replaced by the previous one has been released by the requests still
+    using it. So at most two snapshots are alive: the one being served and
+    the one being built. If it is still in use after ``retire_timeout``
+    seconds, the build is skipped and tried again by the next one, e.g. at
+    the next scheduled rebuild. If a build fails, the current snapshot
+    stays in place. A builder may return None when the current snapshot is still up
+    to date.
+
+    ``reloader`` is a cheaper builder run every ``reload_interval``
+    seconds, e.g. to pick up artifacts saved by another process.
+    """
+
+    def __init__(
+        self, builder, interval=0, retire_timeout=60, reloader=None, reload_interval=0
+    ):
+        self.builder = builder
+        # Seconds between scheduled rebuilds; 0 disables the schedule
+        self.interval = interval
+        self.reloader = reloader
+        self.reload_interval = reload_interval if reloader is not None else 0
+        self.retire_timeout = retire_timeout
+        self.current = None
+        self.builds = 0
+        self.last_error = None
+        self.last_duration = None
+        self._retired = None
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._schedulers = []
+
+    @property
+    def building(self):
+        return self._build_lock.locked()
+
+    def publish(self, snapshot):
+        """Make ``snapshot`` the one new requests are served from"""
+        previous, self.current = self.current, snapshot
+        # Keep only a weak reference so in-flight requests decide when it goes
+        self._retired = weakref.ref(previous) if previous is not None else None
+
+    def rebuild(self, wait=False):
+        """Build a new snapshot and publish it when it is complete
+
+        Returns False without doing anything if a build is already running.
+        With ``wait`` the build runs on the calling thread and the return
+        value says whether it succeeded; otherwise it runs on a background
+        thread and True means it was started.
+        """
+        if not self._build_lock.acquire(blocking=False):
+            return False
+        if wait:
+            return self._build(self.builder)
+        threading.Thread(
+            target=self._build, args=(self.builder,), name="model-rebuild", daemon=True
+        ).start()
+        return True
+
+    def reload(self):
+        """Run ``reloader`` on the calling thread, unless a build is running"""
+        if not self._build_lock.acquire(blocking=False):
+            return False
+        return self._build(self.reloader)
+
+    def _build(self, builder):
+        try:
+            if not self._wait_for_retired():
+                self.last_error = "Retired snapshot still in use, rebuild postponed"
+                metrics.MODEL_REBUILDS.inc(result="postponed")
+                logger.warning(
+                    "Retired snapshot still referenced after %ss, keeping the "
+                    "current snapshot until the next rebuild",
+                    self.retire_timeout,
+                )
+                return False
+            start = time.perf_counter()
+            with metrics.build_stage("rebuild"):
+                snapshot = builder()
+            self.last_duration = time.perf_counter() - start
+            if snapshot is None:
+                self.last_error = None
+                metrics.MODEL_REBUILDS.inc(result="unchanged")
+                return True
+            self.publish(snapshot)
+            self.builds += 1
+            self.last_error = None
+            metrics.MODEL_REBUILDS.inc(result="success")
+            logger.info("Published model snapshot build=%d", self.builds)
+            return True
+        except Exception as e:
+            self.last_error = str(e)
+            metrics.MODEL_REBUILDS.inc(result="error")
+            logger.exception("Model rebuild failed, keeping the current snapshot")
+            return False
+        finally:
+            self._build_lock.release()
+
+    def _wait_for_retired(self):
+        """Wait until the previously replaced snapshot has been freed
+
+        Returns False if it is still referenced after ``retire_timeout``.
+        """
+        deadline = time.monotonic() + self.retire_timeout
+        while self._retired is not None and self._retired() is not None:
+            gc.collect()
+            if self._retired() is None:
+                break
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.1)
+        self._retired = None
+        return True
+
+    def start(self):
+        """Start scheduled rebuilds and reloads at their intervals"""
+        if self._schedulers:
+            return
+        self._stop.clear()
+        jobs = [
+            ("model-schedule", self.interval, lambda: self.rebuild(wait=True)),
+            ("model-reload", self.reload_interval, self.reload),
+        ]
+        for name, interval, job in jobs:
+            if interval > 0:
+                thread = threading.Thread(
+                    target=self._schedule, args=(interval, job), name=name, daemon=True
+                )
+                thread.start()
+                self._schedulers.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._schedulers:
+            thread.join()
+        self._schedulers = []
+
+    def _schedule(self, interval, job):
+        while not self._stop.wait(interval):
+            job()
+
+    def status(self):
+        """Build counters and the age of the current snapshot"""
+        current = self.current
+        return {
+            "building": self.building,
+            "builds": self.builds,
+            "model_version": current.engine.version if current else None,
+            "snapshot_created": current.created if current else None,
+            "last_build_seconds": (
+                round(self.last_duration, 3) if self.last_duration else None
+            ),
+            "last_error": self.last_error,
+            "refresh_interval": self.interval,
+            "reload_interval": self.reload_interval,
+        }
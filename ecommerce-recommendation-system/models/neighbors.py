@@ -0,0 +1,245 @@
+import os
+import numpy as np
+import scipy.sparse as sp
+from models.parallel import thread_pool
+
+
+class TopKNeighbors:
+    """Fixed-width top-k cosine neighbor lists for the rows of a matrix
+
+    Similarities are computed one block of rows at a time and only the best
+    ``k`` neighbors of each row are kept, so memory is O(n_rows * k) instead
+    of O(n_rows ** 2). Rows with fewer than ``k`` neighbors are padded with
+    ``-1`` ids and zero scores. Sparse blocks are ranked in place; blocks
+    denser than ``dense_threshold`` go through a dense partial selection.
+    Blocks are spread over ``n_jobs`` threads (or the threads of the pool
+    given to ``fit``), so at most that many blocks of similarities exist at
+    a time.
+    """
+
+    def __init__(self, k=20, block_size=2048, dense_threshold=0.1, n_jobs=1):
+        self.k = k
+        self.block_size = block_size
+        self.dense_threshold = dense_threshold
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        self.indices = None
+        self.scores = None
+        self.norms = None
+
+    @classmethod
+    def from_arrays(cls, indices, scores):
+        """Wrap existing neighbor arrays, e.g. memory-mapped ones"""
+        index = cls(k=indices.shape[1])
+        index.indices = indices
+        index.scores = scores
+        return index
+
+    @classmethod
+    def empty(cls, n_rows, k):
+        """Neighbor lists with no neighbors, used when a build fails"""
+        return cls.from_arrays(
+            np.full((n_rows, k), -1, dtype=np.int32),
+            np.zeros((n_rows, k), dtype=np.float32),
+        )
+
+    @classmethod
+    def from_blocks(cls, n_rows, k, blocks, dense_threshold=0.1):
+        """Neighbor lists from ``(similarity_block, row_ids)`` pairs
+
+        Used for candidate similarities that come from elsewhere, such as an
+        approximate index; each block row is ranked like in ``fit``.
+        """
+        index = cls.empty(n_rows, k)
+        index.dense_threshold = dense_threshold
+        for block, row_ids in blocks:
+            index._fill_rows(block, row_ids)
+        return index
+
+    @staticmethod
+    def row_norms(matrix):
+        """L2 norm of every row of a sparse matrix"""
+        squared = matrix.multiply(matrix).sum(axis=1)
+        return np.sqrt(np.asarray(squared, dtype=np.float32).ravel())
+
+    def fit(self, matrix, pool=None):
+        """Build the neighbor lists for every row of ``matrix``
+
+        ``pool`` is a thread pool to run the blocks on instead of a new one.
+        """
+        matrix = sp.csr_matrix(matrix, dtype=np.float32)
+        n_rows = matrix.shape[0]
+
+        self.norms = self.row_norms(matrix)
+        self.indices = np.full((n_rows, self.k), -1, dtype=np.int32)
+        self.scores = np.zeros((n_rows, self.k), dtype=np.float32)
+
+        matrix_t = matrix.T.tocsr()
+
+        def fill_block(start):
+            # Blocks write disjoint rows, so they can run in any order
+            row_ids = np.arange(start, min(start + self.block_size, n_rows))
+            self._fill_rows(self._similarities(matrix, matrix_t, row_ids), row_ids)
+
+        starts = range(0, n_rows, self.block_size)
+        if pool is None and (self.n_jobs == 1 or len(starts) == 1):
+            for start in starts:
+                fill_block(start)
+        else:
+            # Sparse products and sorting release the GIL
+            with thread_pool(min(self.n_jobs, len(starts)), pool) as pool:
+                pool.map(fill_block, starts, chunksize=1)
+
+        return self
+
+    def update(self, matrix, row_ids, matrix_t=None):
+        """Refresh neighbor lists after the rows ``row_ids`` of ``matrix`` changed
+
+        ``matrix`` may have grown since the last build; new rows must be part
+        of ``row_ids``. Only lists that involve a changed row are touched:
+        those are recomputed or merged with the new scores, and every other
+        list is left as it is. ``matrix_t`` is the transpose of ``matrix``
+        as CSR, when the caller keeps one up to date; otherwise it is built.
+        """
+        matrix = sp.csr_matrix(matrix, dtype=np.float32)
+        row_ids = np.unique(np.asarray(row_ids, dtype=np.int64))
+        self._grow(matrix)
+        if len(row_ids) == 0:
+            return self
+        self.norms[row_ids] = self.row_norms(matrix[row_ids])
+
+        # Changed rows, and rows that currently list one of them, may lose
+        # neighbors and are recomputed exactly
+        changed = np.zeros(matrix.shape[0], dtype=bool)
+        changed[row_ids] = True
+        listing = (self.indices >= 0) & changed[np.maximum(self.indices, 0)]
+        exact = np.union1d(row_ids, np.flatnonzero(listing.any(axis=1)))
+
+        if matrix_t is None:
+            matrix_t = matrix.T.tocsr()
+        else:
+            matrix_t = sp.csr_matrix(matrix_t, dtype=np.float32)
+        similarities = self._similarities(matrix, matrix_t, exact)
+        self._fill_rows(similarities, exact)
+
+        # Any other row can only gain a changed row as a neighbor, so it is
+        # re-ranked over its current list plus the fresh changed-row scores
+        incoming = similarities[np.isin(exact, row_ids)].T.tocsr()
+        others = np.flatnonzero(np.diff(incoming.indptr) > 0)
+        others = others[~np.isin(others, exact)]
+        if len(others) == 0:
+            return self
+
+        current = self.indices[others]
+        rows, slots = np.nonzero(current >= 0)
+        incoming = incoming[others].tocoo()
+        candidates = sp.csr_matrix(
+            (
+                np.concatenate([self.scores[others][rows, slots], incoming.data]),
+                (
+                    np.concatenate([rows, incoming.row]),
+                    np.concatenate([current[rows, slots], row_ids[incoming.col]]),
+                ),
+            ),
+            shape=(len(others), matrix.shape[0]),
+        )
+        self._fill_rows(candidates, others)
+        return self
+
+    def _grow(self, matrix):
+        """Make the arrays writable (they may be read-only maps) and pad new rows"""
+        n_new = matrix.shape[0] - len(self.indices)
+        if self.norms is None:
+            self.norms = self.row_norms(matrix)
+        if n_new == 0 and self.indices.flags.writeable:
+            return
+
+        self.norms = np.concatenate(
+            [self.norms[: len(self.indices)], np.zeros(n_new, np.float32)]
+        )
+        self.indices = np.concatenate(
+            [self.indices, np.full((n_new, self.k), -1, dtype=np.int32)]
+        )
+        self.scores = np.concatenate(
+            [self.scores, np.zeros((n_new, self.k), dtype=np.float32)]
+        )
+
+    def _similarities(self, matrix, matrix_t, row_ids):
+        """Sparse cosine similarities of ``row_ids`` against every row"""
+        block = (matrix[row_ids] @ matrix_t).tocoo()
+        denominator = self.norms[row_ids[block.row]] * self.norms[block.col]
+        data = np.divide(
+            block.data,
+            denominator,
+            out=np.zeros_like(block.data),
+            where=denominator > 0,
+        )
+        return sp.csr_matrix((data, (block.row, block.col)), shape=block.shape)
+
+    def _fill_rows(self, block, row_ids):
+        """Replace the lists of ``row_ids`` with the top-k of each block row"""
+        self.indices[row_ids] = -1
+        self.scores[row_ids] = 0
+        if block.nnz > self.dense_threshold * block.shape[0] * block.shape[1]:
+            self._fill_dense_rows(block.toarray(), row_ids)
+        else:
+            self._fill_sparse_rows(block.tocoo(), row_ids)
+
+    def _fill_sparse_rows(self, block, row_ids):
+        """Keep the top-k entries of each row of a sparse similarity block"""
+        rows, cols, data = block.row, block.col, block.data
+
+        # Drop self-similarity and non-positive scores
+        keep = (cols != row_ids[rows]) & (data > 0)
+        rows, cols, data = rows[keep], cols[keep], data[keep]
+
+        # Sort by row, then by descending score, and rank within each row
+        order = np.lexsort((cols, -data, rows))
+        rows, cols, data = rows[order], cols[order], data[order]
+        row_starts = np.searchsorted(rows, np.arange(block.shape[0]))
+        rank = np.arange(len(rows)) - row_starts[rows]
+
+        top = rank < self.k
+        self.indices[row_ids[rows[top]], rank[top]] = cols[top]
+        self.scores[row_ids[rows[top]], rank[top]] = data[top]
+
+    def _fill_dense_rows(self, block, row_ids):
+        """Keep the top-k entries of each row of a dense similarity block
+
+        Uses ``argpartition`` so only the selected k entries get sorted.
+        """
+        n_block, n_cols = block.shape
+        block[np.arange(n_block), row_ids] = -np.inf
+        k = min(self.k, n_cols - 1)
+        if k <= 0:
+            return
+
+        top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(block, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        valid = top_scores > 0
+        self.indices[row_ids, :k] = np.where(valid, top, -1)
+        self.scores[row_ids, :k] = np.where(valid, top_scores, 0)
+
+    def to_csr(self):
+        """The neighbor lists as a sparse ``(n_rows, n_rows)`` similarity matrix"""
+        n_rows = len(self.indices)
+        valid = self.indices >= 0
+        counts = valid.sum(axis=1)
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return sp.csr_matrix(
+            (self.scores[valid], self.indices[valid], indptr), shape=(n_rows, n_rows)
+        )
+
+    def neighbors(self, row):
+        """Return the neighbor ids and scores of ``row``, best first"""
+        ids = self.indices[row]
+        valid = ids >= 0
+        return ids[valid], self.scores[row][valid]
+
+    @property
+    def nbytes(self):
+        return self.indices.nbytes + self.scores.nbytes
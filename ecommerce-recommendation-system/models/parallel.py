@@ -0,0 +1,16 @@
+import contextlib
+from multiprocessing.pool import ThreadPool
+
+
+@contextlib.contextmanager
+def thread_pool(n_jobs, pool=None):
+    """Yield ``pool``, or else a new pool of ``n_jobs`` threads closed on exit
+
+    A model build hands one pool to all of its stages, so blocks from
+    stages running at the same time share its threads.
+    """
+    if pool is not None:
+        yield pool
+        return
+    with ThreadPool(n_jobs) as pool:
+        yield pool
@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+class ProductFilters:
+    """Precomputed product masks for constrained recommendations
+
+    Every category and brand, and the in-stock flag, has a packed bitset
+    over product codes; price and discount are kept as arrays for range
+    tests. A filter is combined into one boolean mask (values of a field
+    are OR-ed, fields are AND-ed) which is applied to the scores before
+    top-k. Masks are cached per distinct filter, so repeated filters cost
+    a lookup.
+    """
+
+    FIELDS = ("category", "brand", "min_price", "max_price", "in_stock", "min_discount")
+
+    def __init__(self, n_products, bitsets, price, discount, max_cached=256):
+        self.n_products = n_products
+        self.bitsets = bitsets
+        self.price = price
+        self.discount = discount
+        self.max_cached = max_cached
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_catalog(cls, catalog, product_map):
+        """Build the masks for the products of ``catalog``, by product code"""
+        n_products = len(product_map)
+        codes = product_map.transform(catalog.columns["product_id"])
+        known = codes >= 0
+        codes = codes[known]
+
+        def by_code(column, fill, dtype):
+            values = np.full(n_products, fill, dtype=dtype)
+            if column in catalog.columns:
+                values[codes] = np.asarray(catalog.columns[column])[known]
+            return values
+
+        bitsets = {}
+        for field in ("category", "brand"):
+            bitsets[field] = {}
+            if field not in catalog.columns:
+                continue
+            labels, inverse = np.unique(
+                np.asarray(catalog.columns[field])[known].astype(str),
+                return_inverse=True,
+            )
+            for i, label in enumerate(labels.tolist()):
+                mask = np.zeros(n_products, dtype=bool)
+                mask[codes[inverse == i]] = True
+                bitsets[field][label] = np.packbits(mask)
+
+        in_stock = by_code("in_stock", False, bool)
+        bitsets["in_stock"] = {True: np.packbits(in_stock)}
+
+        return cls(
+            n_products,
+            bitsets,
+            by_code("price", np.nan, np.float32),
+            by_code("discount", 0, np.float32),
+        )
+
+    @classmethod
+    def normalize(cls, filters):
+        """Canonical, hashable form of a filter dict; empty values are dropped
+
+        ``category`` and ``brand`` take one value or a list, ``in_stock`` a
+        bool and the rest numbers. A false ``in_stock`` means no stock
+        constraint, not out-of-stock products only. Raises ValueError for
+        anything else.
+        """
+        if not filters:
+            return ()
+        unknown = set(filters) - set(cls.FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+
+        key = []
+        for field in cls.FIELDS:
+            value = filters.get(field)
+            if value is None or value == "" or value == []:
+                continue
+            if field in ("category", "brand"):
+                values = [value] if isinstance(value, str) else value
+                value = tuple(sorted(str(v) for v in values))
+            elif field == "in_stock":
+                if isinstance(value, str):
+                    value = value.lower() in ("1", "true", "yes")
+                if not value:
+                    continue
+                value = True
+            else:
+                value = float(value)
+            key.append((field, value))
+        return tuple(key)
+
+    def mask(self, filters):
+        """Boolean mask over product codes, or None if ``filters`` is empty"""
+        key = self.normalize(filters)
+        if not key:
+            return None
+
+        with self._lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+
+        bits = np.full((self.n_products + 7) // 8, 0xFF, dtype=np.uint8)
+        for field, value in key:
+            if field in ("category", "brand"):
+                # Any of the values, e.g. one of several categories
+                field_bits = np.zeros_like(bits)
+                for label in value:
+                    if label in self.bitsets[field]:
+                        np.bitwise_or(
+                            field_bits, self.bitsets[field][label], field_bits
+                        )
+            elif field == "in_stock":
+                field_bits = self.bitsets["in_stock"][True]
+            elif field == "min_price":
+                field_bits = np.packbits(self.price >= value)
+            elif field == "max_price":
+                field_bits = np.packbits(self.price <= value)
+            else:  # min_discount
+                field_bits = np.packbits(self.discount >= value)
+            np.bitwise_and(bits, field_bits, bits)
+
+        mask = np.unpackbits(bits, count=self.n_products).astype(bool)
+        mask.flags.writeable = False
+        with self._lock:
+            self._masks[key] = mask
+            while len(self._masks) > self.max_cached:
+                self._masks.popitem(last=False)
+        return mask
+
+    @property
+    def nbytes(self):
+        bitsets = sum(
+            bits.nbytes for masks in self.bitsets.values() for bits in masks.values()
+        )
+        return bitsets + self.price.nbytes + self.discount.nbytes
@@ -0,0 +1,94 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecommendationCache:
+    """Bounded LRU cache of recommendation lists with a time-to-live
+
+    Entries are keyed by ``(model_version, user_id, method, n)``. A rebuild
+    bumps the engine's version, so every older entry stops matching at once
+    and ages out through normal LRU eviction. Memory is capped by an
+    estimate of the bytes held rather than by entry count.
+    """
+
+    def __init__(self, max_bytes=64 << 20, ttl=300, clock=time.monotonic):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def entry_size(key, value):
+        """Approximate memory held by one entry"""
+        return (
+            sys.getsizeof(key)
+            + sum(sys.getsizeof(part) for part in key)
+            + sys.getsizeof(value)
+            + sum(sys.getsizeof(item) for item in value)
+        )
+
+    def get(self, key):
+        """Cached recommendations for ``key``, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, expires, size = entry
+            if expires <= self.clock():
+                self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(value)
+
+    def put(self, key, value):
+        value = tuple(value)
+        size = self.entry_size(key, value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, self.clock() + self.ttl, size)
+            self.nbytes += size
+
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self.nbytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "bytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+        }
@@ -1,138 +1,383 @@
+import logging
+import os
+from multiprocessing.pool import ThreadPool
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sp
 from sklearn.neighbors import NearestNeighbors
-import pickle
-import os
+from models.als import ImplicitALS
+from models.ann import IVFIndex
+from models.id_map import IdMap
+from models.neighbors import TopKNeighbors
+from models.product_filters import ProductFilters
+from models.recommendation_cache import RecommendationCache
+from models.artifacts import load_artifacts, save_artifacts
+from models import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class RecommendationEngine:
-    def __init__(self, data_processor):
+    # Recommendation methods; anything else is served as "hybrid"
+    METHODS = ("collaborative", "item", "content", "hybrid", "als")
+    # Bytes of dense scores a recommend_batch block may hold at once
+    BATCH_MEMORY = 256 << 20
+
+    def __init__(
+        self,
+        data_processor,
+        n_user_neighbors=5,
+        n_content_neighbors=20,
+        n_item_neighbors=20,
+        n_factors=32,
+        content_index="exact",
+        n_probe=8,
+        hybrid_weights=None,
+        n_hybrid_seeds=3,
+        n_jobs=None,
+    ):
         self.dp = data_processor
+        self.n_user_neighbors = n_user_neighbors
+        self.n_item_neighbors = n_item_neighbors
+        self.n_content_neighbors = n_content_neighbors
+        self.n_factors = n_factors
+        # "exact" compares every product pair, "ivf" only the candidates
+        # from an approximate index probing ``n_probe`` lists
+        self.content_index = content_index
+        self.n_probe = n_probe
+        self.content_ann = None
+        # Blend of the per-product scores that make up a hybrid recommendation
+        self.hybrid_weights = hybrid_weights or {
+            "collaborative": 0.6,
+            "content": 0.3,
+            "popularity": 0.1,
+        }
+        self.n_hybrid_seeds = n_hybrid_seeds
+        # Threads used by the build; defaults to one per core
+        self.n_jobs = n_jobs or os.cpu_count() or 1
+        # Pool shared by the blocks of every stage while a build runs
+        self._block_pool = None
+        self.als = None
+        self.user_neighbors = None
+        self.item_neighbors = None
+        # Item neighbor lists as a sparse item x item matrix, for scoring
+        self.item_similarity = None
+        self.content_neighbors = None
+        self.product_map = IdMap()
+        self.user_map = IdMap()
+        self.product_ids = None
+        self.popular_products = None
+        self._popularity = None
+        self._popular_codes = None
+        self.product_filters = None
         self.user_item_matrix = None
+        self.user_item_matrix_csc = None
         self.product_features = None
         self.tfidf_matrix = None
         self.user_features = None
+        # Bumped on every build, load or ingest; keys the result cache
+        self.version = 0
+        self.cache = RecommendationCache()
 
     def build_models(self):
-        """Build all recommendation models"""
-        print("Building recommendation models...")
+        """Build all recommendation models
+
+        After preprocessing, the independent stages run concurrently, and
+        the similarity, IVF and ALS stages split their work into row blocks.
+        The blocks of every stage share one pool of ``n_jobs`` threads, so
+        at most ``n_jobs`` blocks are in flight at a time.
+        """
+        logger.info("Building recommendation models (n_jobs=%d)", self.n_jobs)
 
-        # Preprocess data
-        self.dp.preprocess_data()
+        with metrics.build_stage("preprocess"):
+            self.dp.preprocess_data()
 
-        # Get matrices
         self.user_item_matrix = self.dp.user_item_matrix
-        self.product_features, self.tfidf_matrix = self.dp.get_product_features()
-        self.user_features = self.dp.get_user_features()
+        self.user_item_matrix_csc = self.dp.user_item_matrix_csc
+        self.user_map = self.dp.user_map
+        self.product_map = self.dp.product_map
+        self.product_ids = self.dp.product_map.ids
 
-        print("Building collaborative filtering model...")
-        # Build collaborative filtering model
-        try:
-            self.collab_similarity = cosine_similarity(self.user_item_matrix)
-            print("Collaborative filtering model built successfully")
-        except Exception as e:
-            print(f"Error building collaborative model: {e}")
-            # Create a dummy similarity matrix
-            n_users = self.user_item_matrix.shape[0]
-            self.collab_similarity = np.eye(n_users)
-
-        print("Building content-based model...")
-        # Build content-based model
-        try:
-            self.content_similarity = cosine_similarity(self.tfidf_matrix)
-            print("Content-based model built successfully")
-        except Exception as e:
-            print(f"Error building content-based model: {e}")
-            n_products = self.tfidf_matrix.shape[0]
-            self.content_similarity = np.eye(n_products)
-
-        print("Building KNN model...")
+        stages = [
+            self._build_content,
+            self._build_collaborative,
+            self._build_item,
+            self._build_als,
+            self._build_user_features,
+            self._build_popularity,
+            self._build_knn,
+        ]
+        # Slowest stages first, so they start before the pool fills up
+        with ThreadPool(self.n_jobs) as blocks, ThreadPool(
+            min(self.n_jobs, len(stages))
+        ) as pool:
+            self._block_pool = blocks
+            try:
+                for result in [pool.apply_async(stage) for stage in stages]:
+                    result.get()
+            finally:
+                self._block_pool = None
+
+        with metrics.build_stage("filters"):
+            self.product_filters = ProductFilters.from_catalog(
+                self.dp.catalog, self.product_map
+            )
+
+        self.version += 1
+        logger.info("All recommendation models built (version %d)", self.version)
+
+    def _build_popularity(self):
+        # Rank every product once so popularity fallbacks are a slice
+        with metrics.build_stage("popularity"):
+            self.popular_products = None
+            self._popularity = None
+            self._popular_codes = None
+            self.popular_products = np.asarray(
+                self.get_popular_products(len(self.product_ids))
+            )
+
+    def _build_user_features(self):
+        with metrics.build_stage("user_features"):
+            self.user_features = self.dp.get_user_features()
+
+    def _build_collaborative(self):
+        with metrics.build_stage("collaborative"):
+            try:
+                self.user_neighbors = TopKNeighbors(
+                    k=self.n_user_neighbors, n_jobs=self.n_jobs
+                ).fit(self.user_item_matrix, self._block_pool)
+                logger.info(
+                    "model=collaborative mb=%.1f", self.user_neighbors.nbytes / 1e6
+                )
+            except Exception:
+                logger.exception("Error building collaborative model")
+                metrics.BUILD_STAGE_ERRORS.inc(stage="collaborative")
+                # Fall back to empty neighbor lists
+                self.user_neighbors = TopKNeighbors.empty(
+                    self.user_item_matrix.shape[0], self.n_user_neighbors
+                )
+
+    def _build_item(self):
+        # Products are compared by the users who rated them
+        with metrics.build_stage("item"):
+            try:
+                self.item_neighbors = TopKNeighbors(
+                    k=self.n_item_neighbors, n_jobs=self.n_jobs
+                ).fit(self.user_item_matrix_csc.T, self._block_pool)
+                logger.info("model=item mb=%.1f", self.item_neighbors.nbytes / 1e6)
+            except Exception:
+                logger.exception("Error building item-based model")
+                metrics.BUILD_STAGE_ERRORS.inc(stage="item")
+                self.item_neighbors = TopKNeighbors.empty(
+                    self.user_item_matrix.shape[1], self.n_item_neighbors
+                )
+            self.item_similarity = self.item_neighbors.to_csr()
+
+    def _build_content(self):
+        with metrics.build_stage("product_features"):
+            self.product_features, self.tfidf_matrix = self.dp.get_product_features()
+
+        with metrics.build_stage("content"):
+            try:
+                if self.content_index == "ivf":
+                    self.content_ann = IVFIndex(
+                        n_probe=self.n_probe, n_jobs=self.n_jobs
+                    ).fit(self.tfidf_matrix, self._block_pool)
+                    self.content_neighbors = TopKNeighbors.from_blocks(
+                        self.tfidf_matrix.shape[0],
+                        self.n_content_neighbors,
+                        self.content_ann.neighbor_blocks(
+                            vectors=self.tfidf_matrix, pool=self._block_pool
+                        ),
+                    )
+                else:
+                    self.content_neighbors = TopKNeighbors(
+                        k=self.n_content_neighbors, block_size=512, n_jobs=self.n_jobs
+                    ).fit(self.tfidf_matrix, self._block_pool)
+                logger.info(
+                    "model=content index=%s mb=%.1f",
+                    self.content_index,
+                    self.content_neighbors.nbytes / 1e6,
+                )
+            except Exception:
+                logger.exception("Error building content-based model")
+                metrics.BUILD_STAGE_ERRORS.inc(stage="content")
+                self.content_neighbors = TopKNeighbors.empty(
+                    self.tfidf_matrix.shape[0], self.n_content_neighbors
+                )
+
+    def _build_als(self):
+        with metrics.build_stage("als"):
+            try:
+                self.als = ImplicitALS(factors=self.n_factors, n_jobs=self.n_jobs).fit(
+                    self.dp.confidence_matrix, self._block_pool
+                )
+                logger.info("model=als mb=%.1f", self.als.nbytes / 1e6)
+            except Exception:
+                logger.exception("Error building matrix factorization model")
+                metrics.BUILD_STAGE_ERRORS.inc(stage="als")
+                self.als = None
+
+    def _build_knn(self):
         # Build KNN model for hybrid approach
-        try:
-            self.knn_model = NearestNeighbors(n_neighbors=10, metric="cosine")
-            self.knn_model.fit(self.user_item_matrix)
-            print("KNN model built successfully")
-        except Exception as e:
-            print(f"Error building KNN model: {e}")
-            self.knn_model = None
+        with metrics.build_stage("knn"):
+            try:
+                self.knn_model = NearestNeighbors(n_neighbors=10, metric="cosine")
+                self.knn_model.fit(self.user_item_matrix)
+            except Exception:
+                logger.exception("Error building KNN model")
+                metrics.BUILD_STAGE_ERRORS.inc(stage="knn")
+                self.knn_model = None
+
+    def model_sizes(self):
+        """Bytes held by each built model component"""
+        sizes = {}
+        if self.user_neighbors is not None:
+            sizes["user_neighbors"] = self.user_neighbors.nbytes
+        if self.item_neighbors is not None:
+            sizes["item_neighbors"] = self.item_neighbors.nbytes
+        if self.product_filters is not None:
+            sizes["product_filters"] = self.product_filters.nbytes
+        if self.content_neighbors is not None:
+            sizes["content_neighbors"] = self.content_neighbors.nbytes
+        if self.content_ann is not None:
+            sizes["content_ann"] = self.content_ann.nbytes
+        if self.als is not None:
+            sizes["als"] = self.als.nbytes
+        for name in ("user_item_matrix", "tfidf_matrix"):
+            matrix = getattr(self, name)
+            if matrix is not None:
+                sizes[name] = (
+                    matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+                )
+        return sizes
+
+    def ingest(self, transactions):
+        """Fold new transactions into the built models without a full rebuild
 
-        print("All recommendation models built successfully!")
+        Updates the data processor, then refreshes neighbor lists only for
+        the users who transacted and the products they bought. Popularity
+        rankings are left as they are until the next full build, apart from
+        new products being appended at the end.
+        """
+        user_codes, product_codes, new_products = self.dp.ingest(transactions)
 
-    def collaborative_filtering(self, user_id, n_recommendations=10):
+        self.user_item_matrix = self.dp.user_item_matrix
+        self.user_item_matrix_csc = self.dp.user_item_matrix_csc
+        self.product_ids = self.dp.product_map.ids
+
+        if len(new_products) > 0:
+            features = self.dp.transform_product_features(
+                pd.DataFrame(self.dp.catalog.get_many(self.product_ids[new_products]))
+            )
+            self.tfidf_matrix = sp.vstack([self.tfidf_matrix, features]).tocsr()
+            self.content_neighbors.update(self.tfidf_matrix, new_products)
+            if self.content_ann is not None:
+                self.content_ann.add(features)
+            self.popular_products = np.concatenate(
+                [self.popular_products, self.product_ids[new_products]]
+            )
+            self.product_filters = ProductFilters.from_catalog(
+                self.dp.catalog, self.product_map
+            )
+
+        # Each matrix is the other's transpose, so neither update rebuilds one
+        self.user_neighbors.update(
+            self.user_item_matrix, user_codes, self.user_item_matrix_csc.T
+        )
+        self.item_neighbors.update(
+            self.user_item_matrix_csc.T, product_codes, self.user_item_matrix
+        )
+        self.item_similarity = self.item_neighbors.to_csr()
+        if self.als is not None:
+            self.als.fold_in(self.dp.confidence_matrix, user_codes)
+        self.version += 1
+        logger.info(
+            "ingest users=%d new_products=%d version=%d",
+            len(np.unique(user_codes)),
+            len(new_products),
+            self.version,
+        )
+
+    def collaborative_filtering(self, user_id, n_recommendations=10, filters=None):
         """Collaborative filtering based recommendations"""
+        user_idx = self.user_map.code(user_id)
+        if user_idx == IdMap.UNKNOWN:
+            return []
+
         try:
-            user_idx = self.dp.user_encoder.transform([user_id])[0]
-
-            # Get similar users
-            user_similarity = self.collab_similarity[user_idx]
-            similar_users = np.argsort(user_similarity)[::-1][
-                1:6
-            ]  # Top 5 similar users
-
-            # Get products rated by similar users
-            similar_users_ratings = self.user_item_matrix.iloc[similar_users]
-            recommended_products = similar_users_ratings.mean(axis=0).sort_values(
-                ascending=False
-            )
+            # Score the user's unseen products from their similar users
+            scores = self._collaborative_scores(np.array([user_idx]))
+            self._apply_mask(scores, self._filter_mask(filters))
+            top_product_indices = self._top_k(scores, n_recommendations)[0]
 
-            # Filter out already rated products
-            user_ratings = self.user_item_matrix.iloc[user_idx]
-            unrated_products = recommended_products[user_ratings == 0]
+            return self.product_ids[top_product_indices].tolist()
+        except Exception:
+            logger.exception("Error in collaborative filtering user_id=%s", user_id)
+            metrics.RECOMMEND_ERRORS.inc(method="collaborative")
+            return []
 
-            # Get top recommendations
-            top_product_indices = unrated_products.head(n_recommendations).index
-            product_ids = self.dp.product_encoder.inverse_transform(top_product_indices)
+    def content_based_filtering(self, product_id, n_recommendations=10, filters=None):
+        """Content-based recommendations
 
-            return product_ids.tolist()
-        except Exception as e:
-            print(f"Error in collaborative filtering: {e}")
+        Only ``n_content_neighbors`` neighbors are stored per product, and
+        ``filters`` may skip some of them; popular products (that pass the
+        filters) fill the rest of the list.
+        """
+        product_idx = self.product_map.code(product_id)
+        if product_idx == IdMap.UNKNOWN:
             return []
 
-    def content_based_filtering(self, product_id, n_recommendations=10):
-        """Content-based recommendations"""
         try:
-            product_idx = self.product_features[
-                self.product_features["product_id"] == product_id
-            ].index[0]
-
             # Get similar products
-            product_similarity = self.content_similarity[product_idx]
-            similar_products = np.argsort(product_similarity)[::-1][
-                1 : n_recommendations + 1
-            ]
+            similar_products, _ = self.content_neighbors.neighbors(product_idx)
+            mask = self._filter_mask(filters)
+            if mask is not None:
+                similar_products = similar_products[mask[similar_products]]
+            similar_products = self._top_up(
+                similar_products,
+                n_recommendations,
+                self._popular_candidates(mask),
+                product_idx,
+            )
 
-            recommended_product_ids = self.product_features.iloc[similar_products][
-                "product_id"
+            recommended_product_ids = self.product_ids[
+                similar_products[:n_recommendations]
             ].tolist()
             return recommended_product_ids
-        except Exception as e:
-            print(f"Error in content-based filtering: {e}")
+        except Exception:
+            logger.exception(
+                "Error in content-based filtering product_id=%s", product_id
+            )
+            metrics.RECOMMEND_ERRORS.inc(method="content")
             return []
 
-    def hybrid_recommendation(self, user_id, n_recommendations=10):
+    def hybrid_recommendation(self, user_id, n_recommendations=10, filters=None):
         """Hybrid recommendation combining collaborative and content-based filtering"""
-        print(f"Generating hybrid recommendations for user {user_id}")
-
-        collab_recs = self.collaborative_filtering(user_id, n_recommendations)
+        user_idx = self.user_map.code(user_id)
+        return self._hybrid_block(
+            np.array([user_idx]), n_recommendations, self._filter_mask(filters)
+        )[0]
 
-        # If user has no history, use popular products
-        if not collab_recs:
-            print("No collaborative recommendations, using popular products")
-            return self.get_popular_products(n_recommendations)
-
-        # Enhance with content-based recommendations
-        enhanced_recs = []
-        for product_id in collab_recs[:3]:  # Use top 3 from collaborative
-            content_recs = self.content_based_filtering(product_id, 2)
-            enhanced_recs.extend(content_recs)
+    def matrix_factorization(self, user_id, n_recommendations=10, filters=None):
+        """Latent factor recommendations from the ALS model"""
+        user_idx = self.user_map.code(user_id)
+        return self._als_block(
+            np.array([user_idx]), n_recommendations, self._filter_mask(filters)
+        )[0]
 
-        # Combine and remove duplicates
-        all_recs = list(set(collab_recs + enhanced_recs))
-        return all_recs[:n_recommendations]
+    def item_based_filtering(self, user_id, n_recommendations=10, filters=None):
+        """Recommendations from the products similar to the user's products"""
+        user_idx = self.user_map.code(user_id)
+        return self._item_block(
+            np.array([user_idx]), n_recommendations, self._filter_mask(filters)
+        )[0]
 
     def get_popular_products(self, n_recommendations=10):
         """Get most popular products based on ratings and purchase count"""
+        if self.popular_products is not None:
+            return self.popular_products[:n_recommendations].tolist()
+
         try:
             popularity = (
                 self.dp.df.groupby("product_id")
@@ -146,38 +391,395 @@ class RecommendationEngine:
             ].tolist()
 
             return popular_products
-        except Exception as e:
-            print(f"Error getting popular products: {e}")
+        except Exception:
+            logger.exception("Error getting popular products")
             # Return random products as fallback
             return self.dp.df["product_id"].sample(n_recommendations).tolist()
 
-    def get_user_recommendations(self, user_id, method="hybrid", n_recommendations=10):
-        """Get recommendations for a user based on specified method"""
-        print(f"Getting {method} recommendations for user {user_id}")
+    def get_user_recommendations(
+        self, user_id, method="hybrid", n_recommendations=10, filters=None
+    ):
+        """Get recommendations for a user based on specified method
+
+        ``filters`` restricts the products recommended, e.g.
+        ``{"category": "Electronics", "max_price": 20000, "in_stock": True}``;
+        see ``ProductFilters`` for the fields.
+        """
+        # Unknown methods run as hybrid; label and cache them as such so
+        # clients can't create metric series or cache entries at will
+        if method not in self.METHODS:
+            method = "hybrid"
+        with metrics.RECOMMEND_SECONDS.time(method=method):
+            filter_key = ProductFilters.normalize(filters)
+            key = (self.version, user_id, method, n_recommendations, filter_key)
+            recommendations = self.cache.get(key)
+            cached = recommendations is not None
+            if not cached:
+                recommendations = self._recommend(
+                    user_id, method, n_recommendations, filters
+                )
+                self.cache.put(key, recommendations)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "recommend user_id=%s method=%s n=%d cached=%s results=%d",
+                user_id,
+                method,
+                n_recommendations,
+                cached,
+                len(recommendations),
+            )
+        return recommendations
 
+    def _recommend(self, user_id, method, n_recommendations, filters=None):
+        """Compute recommendations for one user, bypassing the cache"""
         if method == "collaborative":
-            return self.collaborative_filtering(user_id, n_recommendations)
+            return self.collaborative_filtering(user_id, n_recommendations, filters)
+        elif method == "als":
+            return self.matrix_factorization(user_id, n_recommendations, filters)
+        elif method == "item":
+            return self.item_based_filtering(user_id, n_recommendations, filters)
         elif method == "content":
             # For content-based, we need a product ID, so we'll use user's last viewed product
-            user_history = self.dp.df[self.dp.df["user_id"] == user_id]
-            if len(user_history) > 0:
-                last_product = user_history.iloc[-1]["product_id"]
-                return self.content_based_filtering(last_product, n_recommendations)
+            last_items = self.dp.user_history.last_items(user_id, 1)
+            if len(last_items) > 0:
+                last_product = self.product_ids[last_items[0]]
+                return self.content_based_filtering(
+                    last_product, n_recommendations, filters
+                )
             else:
-                return self.get_popular_products(n_recommendations)
+                return self._popular(n_recommendations, self._filter_mask(filters))
         else:  # hybrid
-            return self.hybrid_recommendation(user_id, n_recommendations)
+            return self.hybrid_recommendation(user_id, n_recommendations, filters)
+
+    def prewarm_cache(self, user_ids, methods=("hybrid",), n_recommendations=10):
+        """Fill the result cache for ``user_ids`` using the batch path"""
+        user_ids = list(user_ids)
+        for method in methods:
+            recommendations = self.recommend_batch(user_ids, method, n_recommendations)
+            for user_id, products in zip(user_ids, recommendations):
+                self.cache.put(
+                    (self.version, user_id, method, n_recommendations, ()), products
+                )
+        logger.info("Prewarmed recommendation cache for %d users", len(user_ids))
+
+    def recommend_batch(
+        self,
+        user_ids,
+        method="hybrid",
+        n_recommendations=10,
+        block_size=None,
+        filters=None,
+    ):
+        """Get recommendations for many users at once
+
+        Users are scored a block at a time with sparse matrix products and a
+        batched top-k selection. Returns one list of product ids per user, in
+        the order of ``user_ids``, with the same fallbacks and ``filters`` as
+        ``get_user_recommendations``. By default blocks have as many users as
+        fit in ``BATCH_MEMORY``.
+        """
+        user_ids = list(user_ids)
+        mask = self._filter_mask(filters)
+        recommendations = []
+        block_size = block_size or self._batch_block_size(method)
+
+        for start in range(0, len(user_ids), block_size):
+            user_codes = self.user_map.transform(user_ids[start : start + block_size])
+
+            if method == "collaborative":
+                recommendations.extend(
+                    self._collaborative_block(user_codes, n_recommendations, mask)
+                )
+            elif method == "als":
+                recommendations.extend(
+                    self._als_block(user_codes, n_recommendations, mask)
+                )
+            elif method == "item":
+                recommendations.extend(
+                    self._item_block(user_codes, n_recommendations, mask)
+                )
+            elif method == "content":
+                recommendations.extend(
+                    self._content_block(user_codes, n_recommendations, mask)
+                )
+            else:  # hybrid
+                recommendations.extend(
+                    self._hybrid_block(user_codes, n_recommendations, mask)
+                )
+
+        return recommendations
+
+    def _batch_block_size(self, method):
+        """Users per recommend_batch block that keep it within BATCH_MEMORY
+
+        A block holds a few dense ``(users, n_products)`` arrays at once: the
+        scores, their negation and the top-k partition indices, plus the
+        component scores for hybrid.
+        """
+        if method == "content":
+            # Reads the stored neighbor lists, no dense scores
+            return 1024
+        live_blocks = 6 if method not in self.METHODS or method == "hybrid" else 3
+        row_bytes = max(len(self.product_ids), 1) * np.dtype(np.float64).itemsize
+        return max(1, self.BATCH_MEMORY // (row_bytes * live_blocks))
+
+    def _collaborative_scores(self, user_codes):
+        """Mean ratings of each user's neighbors over all products
+
+        Returns a dense ``(len(user_codes), n_products)`` block in which
+        already rated products, and every product of users without
+        neighbors, are ``-inf``. ``user_codes`` must all be known users.
+        """
+        n_users, n_products = self.user_item_matrix.shape
+        neighbors = self.user_neighbors.indices[user_codes]
+        rows, slots = np.nonzero(neighbors >= 0)
+        counts = np.bincount(rows, minlength=len(user_codes))
+
+        weights = sp.csr_matrix(
+            (
+                1.0 / counts[rows].astype(np.float32),
+                (rows, neighbors[rows, slots]),
+            ),
+            shape=(len(user_codes), n_users),
+        )
+        scores = (weights @ self.user_item_matrix).toarray()
+
+        # Filter out already rated products
+        seen_rows, seen_cols = self.user_item_matrix[user_codes].nonzero()
+        scores[seen_rows, seen_cols] = -np.inf
+        scores[counts == 0] = -np.inf
+        return scores
+
+    def _filter_mask(self, filters):
+        """Product mask for ``filters``, or None if there are none"""
+        if not filters:
+            return None
+        if self.product_filters is None:
+            raise ValueError("Product filters are not available for this model")
+        return self.product_filters.mask(filters)
+
+    @staticmethod
+    def _apply_mask(scores, mask):
+        """Exclude the products outside ``mask`` from a score block"""
+        if mask is not None:
+            scores[:, ~mask] = -np.inf
+
+    @staticmethod
+    def _top_k(scores, n):
+        """Column indices of the ``n`` best finite scores per row, best first"""
+        n = min(n, scores.shape[1])
+        if n <= 0:
+            return [np.empty(0, dtype=np.int64) for _ in range(len(scores))]
+
+        top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.lexsort((top, -top_scores))
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        return [
+            row[np.isfinite(row_scores)] for row, row_scores in zip(top, top_scores)
+        ]
+
+    def _collaborative_block(self, user_codes, n_recommendations, mask=None):
+        """Collaborative recommendations for a block of encoded users"""
+        recommendations = [[] for _ in user_codes]
+        known = np.flatnonzero(user_codes >= 0)
+        if len(known) == 0:
+            return recommendations
+
+        scores = self._collaborative_scores(user_codes[known])
+        self._apply_mask(scores, mask)
+        for i, top in zip(known, self._top_k(scores, n_recommendations)):
+            recommendations[i] = self.product_ids[top].tolist()
+        return recommendations
+
+    def _als_block(self, user_codes, n_recommendations, mask=None):
+        """ALS recommendations for a block of encoded users
+
+        Scores are one product of the user factors with the item factors;
+        unknown users, and every user if there is no model, get the popular
+        products. So do users whose scores are all zero, e.g. users folded
+        in with only new products, which have no factors until the next
+        build.
+        """
+        popular = self._popular(n_recommendations, mask)
+        recommendations = [list(popular) for _ in user_codes]
+        known = np.flatnonzero(user_codes >= 0)
+        if len(known) == 0 or self.als is None:
+            return recommendations
+
+        scores = self.als.scores(user_codes[known])
+        seen_rows, seen_cols = self.user_item_matrix[user_codes[known]].nonzero()
+        scores[seen_rows, seen_cols] = -np.inf
+        self._apply_mask(scores, mask)
+        informative = np.any(np.isfinite(scores) & (scores != 0), axis=1)
+        for i, top, useful in zip(
+            known, self._top_k(scores, n_recommendations), informative
+        ):
+            if useful:
+                recommendations[i] = self.product_ids[top].tolist()
+        return recommendations
+
+    def _item_block(self, user_codes, n_recommendations, mask=None):
+        """Item-based recommendations for a block of encoded users
+
+        A user's score for a product is the sum of its similarities to the
+        products they rated, weighted by those ratings: one sparse product
+        of their rating rows with the pruned item similarity matrix. Unknown
+        users, and users whose products have no neighbors, get the popular
+        products.
+        """
+        popular = self._popular(n_recommendations, mask)
+        recommendations = [list(popular) for _ in user_codes]
+        known = np.flatnonzero(user_codes >= 0)
+        if len(known) == 0 or self.item_similarity is None:
+            return recommendations
+
+        ratings = self.user_item_matrix[user_codes[known]]
+        scores = (ratings @ self.item_similarity).toarray()
+        scores[scores <= 0] = -np.inf
+        seen_rows, seen_cols = ratings.nonzero()
+        scores[seen_rows, seen_cols] = -np.inf
+        self._apply_mask(scores, mask)
+        for i, top in zip(known, self._top_k(scores, n_recommendations)):
+            if len(top) > 0:
+                recommendations[i] = self.product_ids[top].tolist()
+        return recommendations
+
+    def _content_block(self, user_codes, n_recommendations, mask=None):
+        """Content recommendations seeded by each user's latest product
+
+        The stored neighbors outside ``mask`` are skipped, and the most
+        popular products inside it fill the rest of the list, e.g. beyond the
+        ``n_content_neighbors`` stored per product.
+        """
+        popular = self._popular(n_recommendations, mask)
+        last_items = self.dp.user_history.latest_items(user_codes)
+        neighbors = self.content_neighbors.indices[last_items]
+        candidates = self._popular_candidates(mask)
+
+        recommendations = []
+        for last_item, row in zip(last_items, neighbors):
+            if last_item < 0:
+                recommendations.append(list(popular))
+                continue
+            row = row[row >= 0]
+            if mask is not None:
+                row = row[mask[row]]
+            row = self._top_up(row, n_recommendations, candidates, last_item)
+            recommendations.append(self.product_ids[row].tolist())
+        return recommendations
+
+    def _hybrid_block(self, user_codes, n_recommendations, mask=None):
+        """Hybrid recommendations for a block of encoded users
+
+        Blends, per product, the user's collaborative score (scaled to the
+        user's best), the mean content similarity to their latest
+        ``n_hybrid_seeds`` products and the product's popularity, using
+        ``hybrid_weights``. Seen products, and products outside ``mask``,
+        are excluded and a single top-k picks the result.
+        """
+        popular = self._popular(n_recommendations, mask)
+        recommendations = [list(popular) for _ in user_codes]
+        known = np.flatnonzero(user_codes >= 0)
+        if len(known) == 0:
+            return recommendations
+
+        codes = user_codes[known]
+        weights = self.hybrid_weights
+        collaborative = self._collaborative_scores(codes)
+        finite = np.isfinite(collaborative)
+        best = np.max(collaborative, axis=1, initial=0, where=finite)
+        collaborative = np.divide(
+            collaborative,
+            best[:, None],
+            out=np.zeros_like(collaborative),
+            where=finite & (best[:, None] > 0),
+        )
+
+        scores = weights.get("collaborative", 0) * collaborative
+        del collaborative, finite
+        scores += weights.get("content", 0) * self._content_scores(codes)
+        scores += weights.get("popularity", 0) * self._popularity_scores()
+
+        seen_rows, seen_cols = self.user_item_matrix[codes].nonzero()
+        scores[scores <= 0] = -np.inf
+        scores[seen_rows, seen_cols] = -np.inf
+        self._apply_mask(scores, mask)
+        for i, top in zip(known, self._top_k(scores, n_recommendations)):
+            recommendations[i] = self.product_ids[top].tolist()
+        return recommendations
+
+    def _content_scores(self, user_codes):
+        """Mean content similarity of every product to each user's latest products"""
+        seeds = self.dp.user_history.recent_items(user_codes, self.n_hybrid_seeds)
+        n_seeds = (seeds >= 0).sum(axis=1)
+        neighbors = self.content_neighbors.indices[np.maximum(seeds, 0)]
+        similarities = self.content_neighbors.scores[np.maximum(seeds, 0)]
+
+        rows, slots, ranks = np.nonzero((seeds >= 0)[:, :, None] & (neighbors >= 0))
+        scores = sp.csr_matrix(
+            (
+                similarities[rows, slots, ranks] / n_seeds[rows],
+                (rows, neighbors[rows, slots, ranks]),
+            ),
+            shape=(len(user_codes), len(self.product_ids)),
+        )
+        return scores.toarray()
+
+    def _popularity_scores(self):
+        """Popularity of every product, from 1 for the top product down to 0"""
+        if self._popularity is None or len(self._popularity) != len(self.product_ids):
+            codes = self.product_map.transform(self.popular_products)
+            popularity = np.zeros(len(self.product_ids), dtype=np.float32)
+            popularity[codes] = 1 - np.arange(len(codes)) / max(len(codes), 1)
+            self._popular_codes = codes
+            self._popularity = popularity
+        return self._popularity
+
+    def _popular(self, n_recommendations, mask=None):
+        """Most popular products, only among those in ``mask`` if given"""
+        if mask is None:
+            return self.get_popular_products(n_recommendations)
+        codes = self._popular_candidates(mask)
+        return self.product_ids[codes[:n_recommendations]].tolist()
+
+    def _popular_candidates(self, mask=None):
+        """Codes of the products from most to least popular, within ``mask``"""
+        self._popularity_scores()
+        if mask is None:
+            return self._popular_codes
+        return self._popular_codes[mask[self._popular_codes]]
+
+    @staticmethod
+    def _top_up(codes, n_recommendations, candidates, seed):
+        """``codes`` followed by ``candidates`` it lacks, up to ``n_recommendations``
+
+        ``seed``, the product the list was built from, is never added.
+        """
+        if len(codes) >= n_recommendations:
+            return codes[:n_recommendations]
+        candidates = candidates[: n_recommendations + len(codes) + 1]
+        candidates = candidates[~np.isin(candidates, codes) & (candidates != seed)]
+        return np.concatenate([codes, candidates[: n_recommendations - len(codes)]])
 
     def save_model(self, path):
-        """Save the recommendation model"""
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        with open(path, "wb") as f:
-            pickle.dump(self, f)
+        """Save the recommendation model as a memory-mappable artifact directory"""
+        with metrics.build_stage("save_artifacts"):
+            save_artifacts(self, path)
 
     @classmethod
-    def load_model(cls, path, data_processor):
-        """Load a saved recommendation model"""
-        with open(path, "rb") as f:
-            model = pickle.load(f)
-            model.dp = data_processor
-            return model
+    def load_model(cls, path, data_processor, **kwargs):
+        """Load a saved recommendation model, memory-mapping its arrays
+
+        ``kwargs`` are passed to the constructor (e.g. ``hybrid_weights``).
+        """
+        model = cls(data_processor, **kwargs)
+        with metrics.build_stage("load_artifacts"):
+            load_artifacts(path, model)
+            model.product_filters = ProductFilters.from_catalog(
+                data_processor.catalog, model.product_map
+            )
+        model.version += 1
+        return model
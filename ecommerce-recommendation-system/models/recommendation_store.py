@@ -0,0 +1,107 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+from models.artifacts import replace_directory
+
+
+class RecommendationStore:
+    """Precomputed top-N recommendation lists on disk
+
+    Each method is a fixed-width ``(n_users, width)`` int32 ``.npy`` array of
+    product ids (int64 if an id does not fit) padded with ``-1``, next to a sorted ``user_ids.npy``. Arrays
+    are opened memory-mapped, so a lookup is a binary search plus one row
+    read and several processes share the same pages.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, path, user_ids, lists, width):
+        self.path = path
+        self.user_ids = user_ids
+        self.lists = lists
+        self.width = width
+
+    @staticmethod
+    def pad(recommendations, width):
+        """Pack lists of product ids into a -1 padded int32 or int64 array
+
+        Ids must be non-negative, since -1 marks the padding.
+        """
+        rows = [
+            np.asarray(product_ids[:width], dtype=np.int64)
+            for product_ids in recommendations
+        ]
+        if any(len(row) > 0 and row.min() < 0 for row in rows):
+            raise ValueError("Negative product ids can't be stored")
+        largest = max((row.max() for row in rows if len(row) > 0), default=0)
+        dtype = np.int32 if largest <= np.iinfo(np.int32).max else np.int64
+
+        packed = np.full((len(rows), width), -1, dtype=dtype)
+        for i, row in enumerate(rows):
+            packed[i, : len(row)] = row
+        return packed
+
+    @classmethod
+    def write(cls, path, user_ids, lists, width):
+        """Write one packed array per method plus the user ids and manifest
+
+        ``lists`` maps each method to an array from ``pad`` with one row per
+        entry of ``user_ids``. The store is written next to ``path`` and
+        renamed into place, so a running app that has the old one open keeps
+        reading it.
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        order = np.argsort(user_ids, kind="stable")
+
+        path = os.path.normpath(path)
+        staging = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        np.save(os.path.join(staging, "user_ids.npy"), user_ids[order])
+        for method, packed in lists.items():
+            np.save(os.path.join(staging, f"{method}.npy"), packed[order])
+
+        with open(os.path.join(staging, cls.MANIFEST), "w") as f:
+            json.dump(
+                {
+                    "methods": sorted(lists),
+                    "width": width,
+                    "n_users": len(user_ids),
+                    "created": time.time(),
+                },
+                f,
+            )
+        replace_directory(staging, path)
+
+    @classmethod
+    def open(cls, path):
+        """Open a store written by ``write`` with memory-mapped arrays"""
+        with open(os.path.join(path, cls.MANIFEST)) as f:
+            manifest = json.load(f)
+
+        user_ids = np.load(os.path.join(path, "user_ids.npy"), mmap_mode="r")
+        lists = {
+            method: np.load(os.path.join(path, f"{method}.npy"), mmap_mode="r")
+            for method in manifest["methods"]
+        }
+        return cls(path, user_ids, lists, manifest["width"])
+
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, cls.MANIFEST))
+
+    def get(self, user_id, method, n_recommendations):
+        """Stored recommendations, or None if they have to be computed live"""
+        packed = self.lists.get(method)
+        if packed is None or n_recommendations > self.width:
+            return None
+
+        row = np.searchsorted(self.user_ids, user_id)
+        if row >= len(self.user_ids) or self.user_ids[row] != user_id:
+            return None
+
+        product_ids = packed[row, :n_recommendations]
+        return product_ids[product_ids >= 0].tolist()
@@ -0,0 +1,369 @@
+"""User-sharded recommendation engine
+
+Users are hash-partitioned over N shards. Each shard is a process that
+loads only its users' transactions and builds a ``RecommendationEngine``
+from them, so it owns that slice of the interaction matrix, the neighbor
+lists and the result cache. A ``ShardedEngine`` coordinator routes a user's
+request to the owning shard and fans batches out to every shard involved,
+then gathers the results back into input order.
+
+Shards talk over ``multiprocessing.connection`` sockets, so the same
+coordinator drives local worker processes (``ShardedEngine.start_local``)
+or shards served on other hosts (``ShardedEngine.connect``):
+
+    SHARD_AUTHKEY=secret python -m models.sharding --shard 0 --shards 4 \\
+        --bind 0.0.0.0:7000
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import threading
+from multiprocessing.connection import Client, Listener
+import numpy as np
+from models.data_processor import DataProcessor
+from models.recommendation_engine import RecommendationEngine
+
+logger = logging.getLogger(__name__)
+
+# Fibonacci hashing constant; spreads sequential ids evenly over the shards
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def shard_of(user_ids, n_shards):
+    """Shard owning each user id, as an array"""
+    ids = np.asarray(user_ids, dtype=np.int64).astype(np.uint64)
+    with np.errstate(over="ignore"):
+        hashed = (ids * _HASH_MULTIPLIER) >> np.uint64(32)
+    return (hashed % np.uint64(n_shards)).astype(np.int64)
+
+
+def build_shard(data_path, shard, n_shards, engine_kwargs=None):
+    """Build an engine from the transactions of the users of one shard"""
+    dp = DataProcessor(data_path)
+    dp.load_partition(
+        lambda user_ids: shard_of(user_ids, n_shards) == shard,
+        columns=DataProcessor.MODEL_COLUMNS,
+    )
+    engine = RecommendationEngine(dp, **(engine_kwargs or {}))
+    engine.build_models()
+    logger.info(
+        "Built shard %d/%d users=%d products=%d",
+        shard,
+        n_shards,
+        len(engine.user_map),
+        len(engine.product_map),
+    )
+    return engine
+
+
+class ShardServer:
+    """Serves one shard's engine to coordinators
+
+    Messages are tuples whose first item names the operation; replies are
+    ``("ok", result)`` or ``("error", message)``. Each connection is served
+    on its own thread, so several coordinators can share a shard.
+    """
+
+    def __init__(self, engine, shard, n_shards, address, authkey):
+        self.engine = engine
+        self.shard = shard
+        self.n_shards = n_shards
+        self.authkey = authkey
+        self.listener = Listener(address, authkey=authkey)
+        # The bound address, with the port picked if ``address`` gave 0
+        self.address = self.listener.address
+        self._stopped = threading.Event()
+
+    def serve(self):
+        """Accept connections until a coordinator sends ``stop``"""
+        logger.info("Shard %d serving on %s:%d", self.shard, *self.address)
+        with self.listener:
+            while not self._stopped.is_set():
+                try:
+                    conn = self.listener.accept()
+                except Exception:
+                    # Failed handshakes (e.g. a wrong authkey) only drop
+                    # that connection
+                    if not self._stopped.is_set():
+                        logger.exception("Shard %d rejected a connection", self.shard)
+                    continue
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        with conn:
+            while True:
+                try:
+                    message = conn.recv()
+                except (EOFError, OSError):
+                    return
+                op, args = message[0], message[1:]
+                if op == "stop":
+                    conn.send(("ok", None))
+                    self._stopped.set()
+                    # Wake the accept loop so it sees the flag
+                    Client(self.address, authkey=self.authkey).close()
+                    return
+                try:
+                    reply = ("ok", self._dispatch(op, args))
+                except Exception as e:
+                    logger.exception("Shard %d failed op=%s", self.shard, op)
+                    reply = ("error", f"{type(e).__name__}: {e}")
+                conn.send(reply)
+
+    def _dispatch(self, op, args):
+        engine = self.engine
+        if op == "recommend":
+            user_id, method, n_recommendations, filters = args
+            return engine.get_user_recommendations(
+                user_id, method, n_recommendations, filters
+            )
+        elif op == "batch":
+            user_ids, method, n_recommendations, filters = args
+            return engine.recommend_batch(
+                user_ids, method, n_recommendations, filters=filters
+            )
+        elif op == "users":
+            return engine.user_map.ids
+        elif op == "stats":
+            return {
+                "shard": self.shard,
+                "users": len(engine.user_map),
+                "products": len(engine.product_map),
+                "model_bytes": sum(engine.model_sizes().values()),
+                "model_version": engine.version,
+                "recommendation_cache": engine.cache.stats(),
+            }
+        raise ValueError(f"Unknown shard operation: {op}")
+
+
+def _run_local_shard(data_path, shard, n_shards, engine_kwargs, authkey, pipe, level):
+    """Worker process: build one shard, report its address, then serve it"""
+    logging.basicConfig(
+        level=level, format=f"%(levelname)s shard={shard} %(name)s %(message)s"
+    )
+    try:
+        engine = build_shard(data_path, shard, n_shards, engine_kwargs)
+        server = ShardServer(engine, shard, n_shards, ("127.0.0.1", 0), authkey)
+    except Exception as e:
+        logger.exception("Shard %d failed to build", shard)
+        pipe.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    pipe.send(("ok", server.address))
+    pipe.close()
+    server.serve()
+
+
+class ShardedEngine:
+    """Coordinator routing requests to the shard that owns each user
+
+    Offers the recommendation calls of ``RecommendationEngine``. Each
+    shard connection carries one request at a time; a batch is sent to all
+    of its shards before any reply is read, so the shards work on it
+    concurrently.
+    """
+
+    def __init__(self, connections, processes=()):
+        self.connections = list(connections)
+        self.n_shards = len(self.connections)
+        self._locks = [threading.Lock() for _ in self.connections]
+        # Local worker processes, stopped by close()
+        self._processes = list(processes)
+
+    @classmethod
+    def connect(cls, addresses, authkey):
+        """Connect to running shard servers, listed in shard order"""
+        return cls([Client(tuple(address), authkey=authkey) for address in addresses])
+
+    @classmethod
+    def start_local(cls, data_path, n_shards, engine_kwargs=None, authkey=None):
+        """Start one worker process per shard and wait until all are built"""
+        authkey = authkey or os.urandom(16)
+        context = multiprocessing.get_context("spawn")
+        level = logging.getLogger().getEffectiveLevel()
+
+        processes, pipes = [], []
+        for shard in range(n_shards):
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_run_local_shard,
+                args=(
+                    data_path,
+                    shard,
+                    n_shards,
+                    engine_kwargs,
+                    authkey,
+                    writer,
+                    level,
+                ),
+                name=f"shard-{shard}",
+                daemon=True,
+            )
+            process.start()
+            writer.close()
+            processes.append(process)
+            pipes.append(reader)
+
+        addresses = []
+        for shard, pipe in enumerate(pipes):
+            try:
+                status, value = pipe.recv()
+            except EOFError:
+                status, value = "error", "worker exited"
+            if status != "ok":
+                for process in processes:
+                    process.terminate()
+                raise RuntimeError(f"Shard {shard} failed to start: {value}")
+            addresses.append(value)
+
+        engine = cls.connect(addresses, authkey)
+        engine._processes = processes
+        return engine
+
+    def _call(self, shard, *message):
+        with self._locks[shard]:
+            self.connections[shard].send(message)
+            reply = self.connections[shard].recv()
+        return self._result(shard, reply)
+
+    @staticmethod
+    def _result(shard, reply):
+        status, value = reply
+        if status != "ok":
+            raise RuntimeError(f"Shard {shard}: {value}")
+        return value
+
+    def shard_of(self, user_id):
+        return int(shard_of([user_id], self.n_shards)[0])
+
+    def get_user_recommendations(
+        self, user_id, method="hybrid", n_recommendations=10, filters=None
+    ):
+        """Recommendations for one user, from the shard that owns it"""
+        return self._call(
+            self.shard_of(user_id),
+            "recommend",
+            user_id,
+            method,
+            n_recommendations,
+            filters,
+        )
+
+    def recommend_batch(
+        self, user_ids, method="hybrid", n_recommendations=10, filters=None
+    ):
+        """Recommendations for many users, in the order of ``user_ids``"""
+        user_ids = np.asarray(list(user_ids), dtype=np.int64)
+        shards = shard_of(user_ids, self.n_shards)
+        positions = {
+            shard: np.flatnonzero(shards == shard)
+            for shard in np.unique(shards).tolist()
+        }
+
+        # Locks are taken in shard order, so concurrent batches can't deadlock
+        locked, sent, replies = [], [], {}
+        try:
+            for shard, index in positions.items():
+                self._locks[shard].acquire()
+                locked.append(shard)
+                self.connections[shard].send(
+                    (
+                        "batch",
+                        user_ids[index].tolist(),
+                        method,
+                        n_recommendations,
+                        filters,
+                    )
+                )
+                sent.append(shard)
+        finally:
+            try:
+                # Read every reply owed, even after a failed send, so the
+                # connections stay in step
+                for shard in sent:
+                    replies[shard] = self.connections[shard].recv()
+            finally:
+                for shard in locked:
+                    self._locks[shard].release()
+
+        recommendations = [None] * len(user_ids)
+        for shard, index in positions.items():
+            for position, products in zip(
+                index.tolist(), self._result(shard, replies[shard])
+            ):
+                recommendations[position] = products
+        return recommendations
+
+    def user_ids(self):
+        """Ids of every user known to the shards, shard by shard"""
+        return np.concatenate(
+            [self._call(shard, "users") for shard in range(self.n_shards)]
+        )
+
+    def stats(self):
+        """Sizes and cache counters per shard"""
+        return [self._call(shard, "stats") for shard in range(self.n_shards)]
+
+    def close(self):
+        """Close the connections, stopping the shards started locally"""
+        for shard, conn in enumerate(self.connections):
+            try:
+                if self._processes:
+                    self._call(shard, "stop")
+                conn.close()
+            except (EOFError, OSError):
+                pass
+        for process in self._processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._processes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def main():
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Serve one recommendation shard")
+    parser.add_argument("--shard", type=int, required=True)
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--bind", default="127.0.0.1:7000", help="host:port")
+    parser.add_argument("--data", default=Config.DATA_FILE)
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=Config.LOG_LEVEL,
+        format=f"%(asctime)s %(levelname)s shard={args.shard} %(name)s %(message)s",
+    )
+    if not Config.SHARD_AUTHKEY:
+        parser.error("SHARD_AUTHKEY must be set")
+
+    engine = build_shard(
+        args.data,
+        args.shard,
+        args.shards,
+        {
+            "content_index": Config.CONTENT_INDEX,
+            "n_probe": Config.CONTENT_N_PROBE,
+            "hybrid_weights": Config.HYBRID_WEIGHTS,
+            "n_jobs": Config.BUILD_WORKERS,
+        },
+    )
+    host, port = args.bind.rsplit(":", 1)
+    server = ShardServer(
+        engine,
+        args.shard,
+        args.shards,
+        (host, int(port)),
+        Config.SHARD_AUTHKEY.encode(),
+    )
+    server.serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Precompute top-N recommendation lists for every user
+
+Builds the models once, fans the users out over worker processes and
+writes the results to a RecommendationStore that the Flask app can serve
+from (see ``SERVE_FROM_STORE`` in config.py).
+
+    python precompute.py --workers 8 --n 20
+
+With ``--shards N`` the users are split over N shard processes (see
+models/sharding.py) instead, each building models for its own users.
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import time
+import numpy as np
+from config import Config
+from models.data_processor import DataProcessor
+from models.recommendation_engine import RecommendationEngine
+from models.recommendation_store import RecommendationStore
+from models.sharding import ShardedEngine
+
+METHODS = ["collaborative", "item", "content", "hybrid", "als"]
+
+# Engine shared with forked workers
+_engine = None
+
+
+def _recommend_chunk(args):
+    """Worker: recommend for one chunk of users and pack the result"""
+    method, user_ids, n_recommendations = args
+    recommendations = _engine.recommend_batch(user_ids, method, n_recommendations)
+    return RecommendationStore.pad(recommendations, n_recommendations)
+
+
+def precompute(engine, user_ids, methods, n_recommendations, workers, chunk_size):
+    """Compute packed recommendation arrays for every method"""
+    global _engine
+    _engine = engine
+
+    chunks = [
+        user_ids[start : start + chunk_size]
+        for start in range(0, len(user_ids), chunk_size)
+    ]
+    lists = {}
+
+    if workers > 1 and "fork" in multiprocessing.get_all_start_methods():
+        # Workers inherit the built engine through fork instead of pickling it
+        context = multiprocessing.get_context("fork")
+        with context.Pool(workers) as pool:
+            for method in methods:
+                tasks = [(method, chunk, n_recommendations) for chunk in chunks]
+                lists[method] = np.vstack(pool.map(_recommend_chunk, tasks))
+    else:
+        for method in methods:
+            tasks = [(method, chunk, n_recommendations) for chunk in chunks]
+            lists[method] = np.vstack([_recommend_chunk(task) for task in tasks])
+
+    return lists
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--data", default=Config.DATA_FILE)
+    parser.add_argument("--output", default=Config.REC_STORE_PATH)
+    parser.add_argument("--n", type=int, default=Config.REC_STORE_WIDTH)
+    parser.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--chunk-size", type=int, default=4096)
+    parser.add_argument(
+        "--shards", type=int, default=1, help="build and serve users in N shards"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=Config.LOG_LEVEL, format="%(levelname)s %(message)s")
+
+    engine_kwargs = {
+        "content_index": Config.CONTENT_INDEX,
+        "n_probe": Config.CONTENT_N_PROBE,
+        "hybrid_weights": Config.HYBRID_WEIGHTS,
+        "n_jobs": Config.BUILD_WORKERS,
+    }
+    start = time.time()
+    if args.shards > 1:
+        # Split the cores between the shards rather than each taking all
+        engine_kwargs["n_jobs"] = Config.BUILD_WORKERS or max(
+            1, (os.cpu_count() or 1) // args.shards
+        )
+        engine = ShardedEngine.start_local(args.data, args.shards, engine_kwargs)
+        user_ids = engine.user_ids().tolist()
+        # The shards already compute in parallel
+        args.workers = 1
+    else:
+        dp = DataProcessor(args.data)
+        dp.load_data(columns=DataProcessor.MODEL_COLUMNS)
+        engine = RecommendationEngine(dp, **engine_kwargs)
+        engine.build_models()
+        user_ids = dp.user_map.ids.tolist()
+    print(f"Models built in {time.time() - start:.1f}s")
+
+    start = time.time()
+    lists = precompute(
+        engine, user_ids, args.methods, args.n, args.workers, args.chunk_size
+    )
+    if args.shards > 1:
+        engine.close()
+    RecommendationStore.write(args.output, user_ids, lists, args.n)
+    print(
+        f"Precomputed {len(args.methods)} methods for {len(user_ids):,} users "
+        f"in {time.time() - start:.1f}s -> {args.output}"
+    )
+
+
+if __name__ == "__main__":
+    main()
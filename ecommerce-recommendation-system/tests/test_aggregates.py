@@ -0,0 +1,42 @@
+import pandas as pd
+from models.aggregates import DashboardAggregates
+from models.data_processor import DataProcessor
+
+
+def write_transactions(path):
+    pd.DataFrame(
+        {
+            "user_id": [1, 1, 2, 3],
+            "product_id": [10, 11, 10, 12],
+            "rating": [4.0, 3.0, 5.0, 2.0],
+            "purchase_count": [1, 2, 1, 3],
+            "product_name": ["A", "B", "A", "C"],
+            "category": ["Books", "Sports", "Books", "Books"],
+            "brand": ["X", "Y", "X", "Z"],
+            "price": [100.0, 250.0, 100.0, 80.0],
+        }
+    ).to_csv(path, index=False)
+
+
+def test_lazily_loaded_data_is_aggregated_once(tmp_path, monkeypatch):
+    data_path = tmp_path / "transactions.csv"
+    write_transactions(data_path)
+    # Not loaded yet, like the processor of a warm-started snapshot
+    dp = DataProcessor(str(data_path))
+    aggregates = DashboardAggregates(dp)
+
+    calls = []
+    compute = DashboardAggregates.compute
+
+    def counting_compute(df, n_top_products=5):
+        calls.append(len(df))
+        return compute(df, n_top_products)
+
+    monkeypatch.setattr(DashboardAggregates, "compute", staticmethod(counting_compute))
+
+    first = aggregates.get()
+    second = aggregates.get()
+
+    assert calls == [4]
+    assert second is first
+    assert first["stats"]["total_users"] == 3
@@ -0,0 +1,47 @@
+import subprocess
+import sys
+from pathlib import Path
+import pandas as pd
+
+SCRIPT = Path(__file__).resolve().parents[1] / "data" / "create_sample_data.py"
+
+
+def run_cli(cwd, *args):
+    return subprocess.run(
+        [sys.executable, str(SCRIPT), "--seed", "1", *args],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def test_cli_writes_and_previews_sample_data(tmp_path):
+    (tmp_path / "data").mkdir()
+    result = run_cli(
+        tmp_path, "--users", "20", "--products", "10", "--transactions", "50"
+    )
+
+    assert "Rating Distribution:" in result.stdout
+    df = pd.read_csv(tmp_path / "data" / "ecommerce_data.csv")
+    assert len(df) == 50
+
+
+def test_cli_writes_shards(tmp_path):
+    run_cli(
+        tmp_path,
+        "--transactions",
+        "50",
+        "--shards",
+        "parts",
+        "--shard-size",
+        "20",
+        "--format",
+        "csv",
+    )
+
+    assert sorted(p.name for p in (tmp_path / "parts").iterdir()) == [
+        "part-00000.csv",
+        "part-00001.csv",
+        "part-00002.csv",
+    ]
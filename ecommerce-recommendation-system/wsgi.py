@@ -0,0 +1,24 @@
+"""WSGI entry point for pre-fork serving
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With ``preload_app`` the gunicorn master imports this module once: it
+builds or loads the models, then forks the workers. The model arrays are
+memory-mapped from the artifact directory, so all workers read the same
+pages and a worker starts without loading anything.
+"""
+
+import gc
+
+# Keep the collector from running while the long-lived model objects are
+# created: collections leave holes in pages the workers would share
+gc.disable()
+
+from app import app, initialize_system
+
+initialize_system(shared=True)
+
+# Move every object into the permanent generation so collections in the
+# workers never write to (and copy) pages inherited from the master.
+# gunicorn.conf.py re-enables the collector in each worker after fork
+gc.freeze()